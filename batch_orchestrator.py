@@ -0,0 +1,279 @@
+import csv
+import glob
+import os
+from functools import partial
+from time import time
+from typing import Iterator
+
+import click
+
+from coloring import PALETTE_NAMES
+from constants import (
+    BINARY_THRESHOLD,
+    DEFAULT_CONNECTIVITY,
+    DEFAULT_SEED,
+    IMAGE_EXTENSIONS,
+    LEGACY_REFERENCE_FILENAME,
+    MAX_IMAGE_SIZE,
+    REFERENCE_FILENAME,
+    SEGMENT_CACHE_MAX_BYTES,
+    SEGMENT_CACHE_PATH,
+    TARGET_PATH,
+    Segmentation,
+    Threshold,
+)
+from image_orchestrator import (
+    WORKER_BASE_AIDS,
+    create_variations,
+    render_variations,
+)
+from segment_cache import SegmentCache
+from utils import get_target_dir_binary, mkdir, parallel_map
+
+SUMMARY_FIELDS = (
+    "image_path",
+    "status",
+    "variation_seconds",
+    "render_seconds",
+    "total_seconds",
+    "error",
+)
+
+
+def get_image_paths(source: str) -> Iterator[str]:
+    """
+    Image paths given either
+    * a directory - all the images in it
+    * a manifest file - one image path per line, '#' for comments
+    * a glob pattern
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, filename)
+            for filename in os.listdir(source)
+            if filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+    if os.path.isfile(source) and not source.lower().endswith(
+        IMAGE_EXTENSIONS
+    ):
+        with open(source) as fh:
+            return [
+                line.strip()
+                for line in fh
+                if line.strip() and not line.startswith("#")
+            ]
+    return sorted(glob.glob(source))
+
+
+def is_processed(image_path: str) -> bool:
+    target_dir_binary = get_target_dir_binary(image_path)
+    return any(
+        os.path.exists(os.path.join(target_dir_binary, filename))
+        for filename in (REFERENCE_FILENAME, LEGACY_REFERENCE_FILENAME)
+    )
+
+
+def process_image_path(
+    image_path: str,
+    versions: int = 1,
+    engine: str = None,
+    connectivity: int = DEFAULT_CONNECTIVITY,
+    cache: SegmentCache = None,
+    preprocess_params: dict = None,
+    seed: int = DEFAULT_SEED,
+    palette_name: str = None,
+) -> dict:
+    """
+    Preprocesses, segments, creates versions and renders a single image.
+    Returns the summary(timings) of the image.
+    """
+    summary = {"image_path": image_path, "status": "done", "error": ""}
+    start = time()
+    try:
+        if is_processed(image_path):
+            summary["status"] = "skipped"
+            return summary
+        create_variations(
+            image_path=image_path,
+            count=versions,
+            engine=engine,
+            connectivity=connectivity,
+            cache=cache,
+            seed=seed,
+            palette_name=palette_name,
+            **(preprocess_params or {}),
+        )
+        summary["variation_seconds"] = round(time() - start, 3)
+        render_start = time()
+        render_variations(
+            image_path=image_path,
+            source_dir_binary=get_target_dir_binary(image_path),
+        )
+        summary["render_seconds"] = round(time() - render_start, 3)
+    except Exception as e:
+        summary["status"] = "failed"
+        summary["error"] = str(e)
+    finally:
+        # the base of an image is not needed by the next one
+        WORKER_BASE_AIDS.clear()
+        summary["total_seconds"] = round(time() - start, 3)
+    return summary
+
+
+def write_summary(summaries: Iterator[dict], summary_path: str):
+    mkdir(os.path.dirname(summary_path) or ".")
+    with open(summary_path, "w", newline="") as fh:
+        writer = csv.DictWriter(fh, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(summaries)
+    print(f"Saved summary to -> {summary_path}")
+
+
+@click.command()
+@click.option(
+    "--source",
+    required=True,
+    type=str,
+    help="Directory, glob pattern or manifest file of the images to draw.",
+)
+@click.option(
+    "--versions",
+    required=False,
+    type=int,
+    default=1,
+    help="Total count of random images to be generated per image.",
+)
+@click.option(
+    "--engine",
+    required=False,
+    type=click.Choice((Segmentation.LABEL, Segmentation.FLOOD)),
+    default=Segmentation.LABEL,
+    help="Segmentation engine.",
+)
+@click.option(
+    "--connectivity",
+    required=False,
+    type=click.Choice(("4", "8")),
+    default=str(DEFAULT_CONNECTIVITY),
+    help="Pixel connectivity used to identify image segments.",
+)
+@click.option(
+    "--workers",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1,
+    help="Processes used to process the images.",
+)
+@click.option(
+    "--summary-path",
+    required=False,
+    type=str,
+    default=None,
+    help="Path of the csv summary with the per image timings.",
+)
+@click.option(
+    "--cache-dir",
+    required=False,
+    type=str,
+    default=SEGMENT_CACHE_PATH,
+    help="Directory of the content addressed segmentation cache.",
+)
+@click.option(
+    "--cache-size",
+    required=False,
+    type=click.IntRange(min=0),
+    default=SEGMENT_CACHE_MAX_BYTES // 1024**2,
+    help="Size bound(MB) of the segmentation cache, 0 disables it.",
+)
+@click.option(
+    "--max-size",
+    required=False,
+    type=click.IntRange(min=1),
+    default=MAX_IMAGE_SIZE,
+    help="Longest side(pixels) the images are downscaled to.",
+)
+@click.option(
+    "--threshold",
+    required=False,
+    type=click.IntRange(min=0, max=255),
+    default=BINARY_THRESHOLD,
+    help="Threshold to binarize the images with the 'fixed' method.",
+)
+@click.option(
+    "--threshold-method",
+    required=False,
+    type=click.Choice((Threshold.FIXED, Threshold.OTSU, Threshold.ADAPTIVE)),
+    default=Threshold.FIXED,
+    help="Method used to binarize the images.",
+)
+@click.option(
+    "--seed",
+    required=False,
+    type=click.IntRange(min=0),
+    default=DEFAULT_SEED,
+    help="Seed of the first version's colors, version i uses seed + i.",
+)
+@click.option(
+    "--palette",
+    required=False,
+    type=click.Choice(PALETTE_NAMES),
+    default=None,
+    help="Colors neighbouring segments apart, with the named palette.",
+)
+def run(
+    source,
+    versions,
+    engine,
+    connectivity,
+    workers,
+    summary_path,
+    cache_dir,
+    cache_size,
+    max_size,
+    threshold,
+    threshold_method,
+    seed,
+    palette,
+):
+    """
+    Random Image (version)generator for a batch of images.
+    """
+    image_paths = get_image_paths(source)
+    print(f"Found {len(image_paths)} images in {source}")
+    results = parallel_map(
+        partial(
+            process_image_path,
+            versions=versions,
+            engine=engine,
+            connectivity=int(connectivity),
+            cache=SegmentCache(
+                cache_dir=cache_dir, max_bytes=cache_size * 1024**2
+            ),
+            preprocess_params={
+                "max_size": max_size,
+                "threshold": threshold,
+                "threshold_method": threshold_method,
+            },
+            seed=seed,
+            palette_name=palette,
+        ),
+        image_paths,
+        workers=workers,
+    )
+    summaries = []
+    for i, summary in enumerate(results):
+        print(
+            f"Processed {i+1} of {len(image_paths)} ->"
+            f" {summary['image_path']} ({summary['status']},"
+            f" {summary['total_seconds']}s) {summary['error']}"
+        )
+        summaries.append(summary)
+    write_summary(
+        summaries=summaries,
+        summary_path=summary_path
+        or os.path.join(TARGET_PATH, f"batch_{int(time()*1000)}.csv"),
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,182 @@
+"""
+Intro/outro clips normalized once, and joined to the main section of a
+video without re-encoding.
+
+* a clip is normalized(scaled, resampled and encoded) to the resolution,
+  frame rate and encoder settings of the main section. Clips without
+  audio get a silent track, so that all the parts have the same streams
+* the normalized clips are cached, keyed on the clip(path, size, mtime)
+  and the settings, so the branded assets are encoded once
+* the parts are joined by the ffmpeg concat demuxer(stream copy), only
+  the main section is encoded per video
+"""
+import hashlib
+import os
+import subprocess
+from typing import Iterator
+
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from constants import (
+    AUDIO_CHANNELS,
+    AUDIO_CODEC,
+    AUDIO_FRAME_RATE,
+    CLIP_CACHE_PATH,
+    ENCODER_PROFILES,
+    VIDEO_CODEC,
+    VIDEO_FRAME_RATE,
+    Encoder,
+    Resolution,
+)
+from utils import mkdir
+from video_encoder import get_output_params
+
+
+def run_ffmpeg(args: Iterator[str]):
+    cmd = [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *args]
+    process = subprocess.run(cmd, capture_output=True, text=True)
+    if process.returncode:
+        raise IOError(
+            f"ffmpeg failed({process.returncode}): {' '.join(cmd)}\n"
+            f"{process.stderr}"
+        )
+
+
+class ClipCache:
+    """Cache of clips normalized to the settings of the main section"""
+
+    def __init__(
+        self,
+        cache_dir: str = None,
+        resolution=Resolution.YOUTUBE_HD,
+        frame_rate: int = VIDEO_FRAME_RATE,
+        profile: str = Encoder.FINAL,
+    ) -> None:
+        self.cache_dir = os.path.abspath(cache_dir or CLIP_CACHE_PATH)
+        self.resolution = resolution
+        self.frame_rate = frame_rate
+        self.profile = profile
+
+    @property
+    def params(self) -> dict:
+        return dict(
+            resolution=self.resolution,
+            frame_rate=self.frame_rate,
+            video_codec=VIDEO_CODEC,
+            **ENCODER_PROFILES[self.profile],
+            audio_codec=AUDIO_CODEC,
+            audio_frame_rate=AUDIO_FRAME_RATE,
+            audio_channels=AUDIO_CHANNELS,
+        )
+
+    def get_key(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(
+            repr(
+                (
+                    os.path.realpath(file_path),
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                    sorted(self.params.items()),
+                )
+            ).encode()
+        )
+        return digest.hexdigest()
+
+    def get_path(self, file_path: str) -> str:
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        return os.path.join(
+            self.cache_dir, f"{stem}_{self.get_key(file_path)}.mp4"
+        )
+
+    def get(self, file_path: str) -> str:
+        """Path of the normalized clip, normalized(once) if not cached"""
+        cache_file_path = self.get_path(file_path)
+        if os.path.exists(cache_file_path):
+            print(f"Clip cache hit -> {cache_file_path}")
+            return cache_file_path
+        mkdir(self.cache_dir)
+        temp_file_path = f"{cache_file_path}.{os.getpid()}.tmp.mp4"
+        print(f"Normalizing {file_path} -> {cache_file_path}")
+        self.normalize(file_path, temp_file_path)
+        # atomic, concurrent jobs may normalize the same clip
+        os.replace(temp_file_path, cache_file_path)
+        return cache_file_path
+
+    def normalize(self, file_path: str, target_file_path: str):
+        height, width = self.resolution
+        infos = ffmpeg_parse_infos(file_path)
+        args = ["-i", file_path]
+        if infos["audio_found"]:
+            audio = "0:a:0"
+        else:
+            args += [
+                "-f",
+                "lavfi",
+                "-i",
+                f"anullsrc=sample_rate={AUDIO_FRAME_RATE}",
+            ]
+            audio = "1:a:0"
+        args += [
+            "-map",
+            "0:v:0",
+            "-map",
+            audio,
+            # scaled to the resolution as VideoFileClip(target_resolution)
+            "-vf",
+            f"scale={width}:{height},setsar=1,fps={self.frame_rate}",
+            # the audio is padded(or cut) to the length of the video
+            "-af",
+            "apad",
+            "-t",
+            str(infos["video_duration"]),
+            "-c:v",
+            VIDEO_CODEC,
+            *get_output_params(profile=self.profile),
+            "-pix_fmt",
+            ENCODER_PROFILES[self.profile]["pix_fmt"],
+            "-c:a",
+            AUDIO_CODEC,
+            "-ar",
+            str(AUDIO_FRAME_RATE),
+            "-ac",
+            str(AUDIO_CHANNELS),
+            target_file_path,
+        ]
+        run_ffmpeg(args)
+
+
+def concat_clips(
+    file_paths: Iterator[str],
+    target_file_path: str,
+    audio_file_path: str = None,
+) -> str:
+    """
+    Joins clips with the same streams and encoder settings, without
+    re-encoding them. The (encoded)audio file, if any, replaces the audio
+    of the clips.
+    """
+    list_file_path = f"{target_file_path}.txt"
+    with open(list_file_path, "w") as fh:
+        for file_path in file_paths:
+            file_path = os.path.realpath(file_path).replace("'", "'\\''")
+            fh.write(f"file '{file_path}'\n")
+    args = ["-f", "concat", "-safe", "0", "-i", list_file_path]
+    if audio_file_path:
+        args += ["-i", audio_file_path, "-map", "0:v:0", "-map", "1:a:0"]
+    try:
+        run_ffmpeg(
+            [
+                *args,
+                "-c",
+                "copy",
+                "-movflags",
+                "+faststart",
+                target_file_path,
+            ]
+        )
+    finally:
+        os.remove(list_file_path)
+    return target_file_path
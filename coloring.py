@@ -0,0 +1,201 @@
+"""
+Colors the segments of an image from a palette, so that neighbouring
+segments are perceptually apart.
+
+* the segment adjacency graph is built once from the label map, the
+  outline(black) pixels are assigned to the closest colored segment so
+  that segments separated by an outline are neighbours
+* the colors are compared in the CIE Lab space (delta E 76)
+* segments are colored greedily, most neighbours first, with a random
+  (seeded) color among the palette colors at least min_distance apart
+  from the colored neighbours. When there is none, darker shades of the
+  palette colors are tried, the lightest first, and the farthest shade
+  is taken only if none of them is min_distance apart either
+"""
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+from constants import MIN_COLOR_DISTANCE
+
+RANDOM_PALETTE = "random"
+# candidate colors per segment of the 'random' palette
+RANDOM_PALETTE_CANDIDATES = 32
+# RGB
+PALETTES = {
+    "pastel": (
+        "ffb3ba ffdfba ffffba baffc9 bae1ff e0bbe4 fec8d8 d4f0f0 cce2cb"
+        " ffccb6"
+    ),
+    "vivid": (
+        "e6194b 3cb44b ffe119 4363d8 f58231 911eb4 46f0f0 f032e6 bcf60c"
+        " fabebe"
+    ),
+    "earth": (
+        "8d6e63 a1887f d7ccc8 c5e1a5 aed581 ffcc80 bcaaa4 e6ce9a 9ccc65"
+        " ff8a65"
+    ),
+    "ocean": (
+        "0077be 00a6d6 48cae4 90e0ef caf0f8 0096c7 023e8a 80ced7 66a5ad"
+        " b3e5fc"
+    ),
+    "sunset": (
+        "ff5f6d ffc371 ff9a8b ff6a88 ff99ac fad0c4 fbc2eb f6d365 fda085"
+        " ffb199"
+    ),
+}
+PALETTE_NAMES = (RANDOM_PALETTE, *PALETTES)
+# brightness of the shades of the palette colors, tried when no palette
+# color is apart from the neighbours
+SHADE_FACTORS = np.linspace(0.9, 0.1, 9)
+
+
+def get_palette_colors(name: str) -> np.ndarray:
+    """(colors, 3) BGR colors of a named palette"""
+    return np.array(
+        [
+            [int(color[i : i + 2], 16) for i in (4, 2, 0)]
+            for color in PALETTES[name].split()
+        ],
+        np.uint8,
+    )
+
+
+def get_lab(colors: np.ndarray) -> np.ndarray:
+    """CIE Lab of (..., 3) BGR uint8 colors"""
+    colors = np.asarray(colors, np.uint8)
+    lab = cv2.cvtColor(
+        colors.reshape(-1, 1, 3).astype(np.float32) / 255, cv2.COLOR_BGR2Lab
+    )
+    return lab.reshape(colors.shape)
+
+
+def get_shades(colors: np.ndarray) -> np.ndarray:
+    """(shades, colors, 3) darker shades of BGR colors, the lightest first"""
+    return (
+        np.asarray(colors, np.float32)[None] * SHADE_FACTORS[:, None, None]
+    ).astype(np.uint8)
+
+
+def get_min_distances(
+    candidates_lab: np.ndarray, neighbours_lab: np.ndarray
+) -> np.ndarray:
+    """Distance of (..., 3) candidate Lab colors to the closest neighbour"""
+    return np.linalg.norm(
+        candidates_lab[..., None, :] - neighbours_lab, axis=-1
+    ).min(axis=-1)
+
+
+def get_segment_adjacency(
+    label_map: np.ndarray, colorable: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (a, b) segment pairs(a < b) of the colorable segments that touch,
+    directly or across the outline(not colorable) pixels between them
+    """
+    mask = ~colorable[label_map]
+    filled = label_map
+    if mask.any() and not mask.all():
+        # label of the closest colorable pixel, numbered in row major order
+        _, labels = cv2.distanceTransformWithLabels(
+            mask.astype(np.uint8),
+            cv2.DIST_L2,
+            3,
+            labelType=cv2.DIST_LABEL_PIXEL,
+        )
+        filled = label_map[~mask][labels - 1]
+    pairs = np.concatenate(
+        [
+            np.stack([filled[:, :-1].ravel(), filled[:, 1:].ravel()], 1),
+            np.stack([filled[:-1].ravel(), filled[1:].ravel()], 1),
+        ]
+    ).astype(np.int64)
+    pairs = np.sort(pairs[pairs[:, 0] != pairs[:, 1]], axis=1)
+    pairs = pairs[colorable[pairs].all(axis=1)]
+    count = len(colorable)
+    keys = np.unique(pairs[:, 0] * count + pairs[:, 1])
+    return keys // count, keys % count
+
+
+def color_segments(
+    adjacency: np.ndarray,
+    base_colors: np.ndarray,
+    colorable: np.ndarray,
+    rng: np.random.Generator,
+    palette_name: str = RANDOM_PALETTE,
+    min_distance: float = MIN_COLOR_DISTANCE,
+) -> np.ndarray:
+    """
+    (segments, 3) colors of the segments, given the (pairs, 2) adjacency.
+    The segments that are not colorable keep their base color.
+    """
+    count = len(base_colors)
+    palette = np.array(base_colors, np.uint8)
+    segments = np.flatnonzero(colorable)
+    if palette_name == RANDOM_PALETTE:
+        candidates = rng.integers(
+            50,
+            256,
+            size=(count, RANDOM_PALETTE_CANDIDATES, 3),
+            dtype=np.uint8,
+        )
+        candidates_lab = get_lab(candidates)
+    else:
+        colors = get_palette_colors(palette_name)
+        candidates = np.broadcast_to(colors, (count, *colors.shape))
+        candidates_lab = np.broadcast_to(
+            get_lab(colors), (count, *colors.shape)
+        )
+    # neighbours of every segment, (compressed)sparse rows
+    a, b = np.asarray(adjacency, np.int64).reshape(-1, 2).T
+    sources = np.concatenate([a, b])
+    targets = np.concatenate([b, a])
+    order = np.argsort(sources, kind="stable")
+    neighbours = targets[order]
+    offsets = np.concatenate(
+        [[0], np.cumsum(np.bincount(sources, minlength=count))]
+    )
+    degrees = np.diff(offsets)
+    colors_lab = np.zeros((count, 3), np.float32)
+    colored = np.zeros(count, bool)
+    for segment in segments[np.argsort(-degrees[segments], kind="stable")]:
+        start, stop = offsets[segment], offsets[segment + 1]
+        segment_neighbours = neighbours[start:stop]
+        segment_neighbours = segment_neighbours[colored[segment_neighbours]]
+        segment_candidates = candidates[segment]
+        segment_candidates_lab = candidates_lab[segment]
+        if len(segment_neighbours):
+            neighbours_lab = colors_lab[segment_neighbours]
+            distances = get_min_distances(
+                segment_candidates_lab, neighbours_lab
+            )
+            allowed = np.flatnonzero(distances >= min_distance)
+            if not len(allowed):
+                # no color is apart, its shades are tried(lightest first)
+                shades = get_shades(segment_candidates)
+                shades_lab = get_lab(shades)
+                shade_distances = get_min_distances(shades_lab, neighbours_lab)
+                apart = shade_distances >= min_distance
+                shade = (
+                    int(np.argmax(apart.any(axis=1)))
+                    if apart.any()
+                    else np.unravel_index(
+                        np.argmax(shade_distances), apart.shape
+                    )[0]
+                )
+                segment_candidates = shades[shade]
+                segment_candidates_lab = shades_lab[shade]
+                distances = shade_distances[shade]
+                allowed = np.flatnonzero(apart[shade])
+            choice = (
+                rng.choice(allowed)
+                if len(allowed)
+                else int(np.argmax(distances))
+            )
+        else:
+            choice = rng.integers(len(segment_candidates_lab))
+        palette[segment] = segment_candidates[choice]
+        colors_lab[segment] = segment_candidates_lab[choice]
+        colored[segment] = True
+    return palette
@@ -1,14 +1,58 @@
 TARGET_PATH = ".data/images"
+SEGMENT_CACHE_PATH = ".data/cache/segments"
+SEGMENT_CACHE_MAX_BYTES = 2 * 1024**3
+# intro/outro clips normalized to the settings of the main section
+CLIP_CACHE_PATH = ".data/cache/clips"
 BIN_FOLDER_NAME = "bin"
 RES_FOLDER_NAME = "out"
 SNAPSHOTS_FOLDER_NAME = "snapshots"
 VIDEO_FOLDER_NAME = "video"
+# the files of the preview renders of an image
+PREVIEW_FOLDER_NAME = "preview"
 LOG_LIMIT = 50
-REFERENCE_FILENAME = "base.pkl"
+REFERENCE_FILENAME = "base.seg"
+LEGACY_REFERENCE_FILENAME = "base.pkl"
+PALETTE_EXTENSION = ".pal"
+BINARY_EXTENSIONS = (".seg", PALETTE_EXTENSION, ".pkl")
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
 FRAME_RATE = 24
+VIDEO_FRAME_RATE = 10
+FREEZE_LAST_FRAME_DURATION = 5
+MAIN_CLIP_FILENAME = "main.mp4"
+BACKGROUND_CLIP_FILENAME = "background.mp4"
+# main section of a video, joined to the intro/outro without re-encoding
+BODY_CLIP_FILENAME = "body.mp4"
+VIDEO_CODEC = "libx264"
+AUDIO_CODEC = "aac"
+AUDIO_FRAME_RATE = 44100
+AUDIO_CHANNELS = 2
+# blur kernel of the background, at the video resolution
+BACKGROUND_BLUR_SIZE = 50
+# the background is blurred at 1/BACKGROUND_SCALE of the video resolution
+BACKGROUND_SCALE = 8
+# shadow around the foreground, at the video resolution
+SHADOW_MARGIN = 20
+SNAPSHOT_WRITER_THREADS = 4
+SNAPSHOT_WRITER_QUEUE_SIZE = 64
+DELTA_FRAMES_FILENAME = "frames.dlt"
+DELTA_KEYFRAME_INTERVAL = 250
+# frames between the checkpoints of a render
+CHECKPOINT_INTERVAL = 500
+CHECKPOINT_EXTENSION = ".ckpt"
 DEFAULT_SNAPSHOT_COUNTER = 500
 LARGE_SEGMENT_PIXEL_COUNT = 5000
 MAX_IMAGE_SIZE = 1000
+# longest side of the image and fraction of the frames of preview renders
+PREVIEW_IMAGE_SIZE = 400
+PREVIEW_FRAME_FRACTION = 0.1
+DEFAULT_CONNECTIVITY = 4
+# seed of the colors of the first version
+DEFAULT_SEED = 0
+# minimum (CIE Lab)distance between the colors of neighbouring segments
+MIN_COLOR_DISTANCE = 20
+BINARY_THRESHOLD = 150
+ADAPTIVE_THRESHOLD_BLOCK_SIZE = 31
+ADAPTIVE_THRESHOLD_C = 10
 SNAPSHOT_TIMES = (
     # no. of pixels in a segment, time to take a snapshot every n updates
     (50, 10),
@@ -27,6 +71,62 @@ SNAPSHOT_TIMES = (
 class Render:
     ACTIVE = "active"
     OFFLINE = "offline"
+    # frames are piped to the video encoder, no snapshots are saved
+    STREAM = "stream"
+    # keyframes + painted pixels of every frame in a single file
+    DELTA = "delta"
+
+
+class SnapshotFormat:
+    PNG = ".png"
+    BMP = ".bmp"
+    JPG = ".jpg"
+
+
+SNAPSHOT_EXTENSIONS = (
+    SnapshotFormat.PNG,
+    SnapshotFormat.BMP,
+    SnapshotFormat.JPG,
+)
+
+
+class Background:
+    # blurred at the video resolution(reference)
+    FULL = "full"
+    # blurred at a reduced resolution and upsampled, unchanged frames reuse
+    # the previous blur
+    FAST = "fast"
+    # "fast", saved once as its own clip and reused
+    PRECOMPUTED = "precomputed"
+
+
+class Encoder:
+    # fast, lower quality encodes to review a render
+    PREVIEW = "preview"
+    FINAL = "final"
+
+
+# x264 settings of the encoder profiles
+ENCODER_PROFILES = {
+    Encoder.PREVIEW: {"preset": "ultrafast", "crf": 30, "pix_fmt": "yuv420p"},
+    Encoder.FINAL: {"preset": "medium", "crf": 20, "pix_fmt": "yuv420p"},
+}
+
+
+class Segmentation:
+    # "flood" is the reference per-pixel flood fill,
+    # "label" labels the whole image in one array-level pass
+    FLOOD = "flood"
+    LABEL = "label"
+
+
+class Threshold:
+    # "fixed" uses BINARY_THRESHOLD(or the given threshold),
+    # "otsu" picks the threshold from the histogram of the image,
+    # "adaptive" thresholds on the mean of each pixel's neighborhood
+    FIXED = "fixed"
+    OTSU = "otsu"
+    ADAPTIVE = "adaptive"
 
 
 class Color:
@@ -36,3 +136,4 @@ class Color:
 
 class Resolution:
     YOUTUBE_HD = (1080, 1920)
+    PREVIEW = (360, 640)
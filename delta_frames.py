@@ -0,0 +1,234 @@
+"""
+Append-only storage of sketcher frames as keyframes plus pixel deltas.
+
+Layout of a delta frames file
+* header - magic (8 bytes) | version | height | width (uint32)
+* records - kind (uint8) | frame index (uint32) | payload length (uint32)
+  followed by the zlib compressed payload
+  * keyframe - the full (height, width, 3) BGR frame
+  * delta - count (uint32) | ys, xs (count uint16) | colors (count, 3)
+    of the pixels painted since the previous frame
+
+A partially written(crashed) last record is ignored by the reader.
+"""
+import os
+import struct
+import zlib
+from typing import Iterator, Tuple
+
+import numpy as np
+
+from constants import DELTA_KEYFRAME_INTERVAL
+
+DELTA_FILE_MAGIC = b"AIDDLT\x00\x00"
+DELTA_FILE_VERSION = 1
+FILE_HEADER = struct.Struct("<8sIII")
+RECORD_HEADER = struct.Struct("<BII")
+COUNT = struct.Struct("<I")
+# zlib level, favours speed over size
+COMPRESSION_LEVEL = 1
+
+
+class FrameKind:
+    KEY = 0
+    DELTA = 1
+
+
+def is_delta_file(file_path: str) -> bool:
+    if not os.path.isfile(file_path):
+        return False
+    with open(file_path, "rb") as fh:
+        return fh.read(len(DELTA_FILE_MAGIC)) == DELTA_FILE_MAGIC
+
+
+class DeltaFrameWriter:
+    """
+    Writes a keyframe every keyframe_interval frames and the painted
+    pixels(co-ordinates + colors) for the frames in between.
+    * with frame_count > 0 an existing file is continued after its first
+      frame_count frames, the frames after them are dropped. The first
+      frame it continues with is a keyframe, the canvas may have pixels
+      painted after the last frame of the file(e.g. the tail of a phase)
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        image_size,
+        keyframe_interval: int = DELTA_KEYFRAME_INTERVAL,
+        frame_count: int = 0,
+    ) -> None:
+        height, width = image_size
+        if max(height, width) > np.iinfo(np.uint16).max:
+            raise ValueError(f"Image too large for delta frames {image_size}")
+        self.file_path = file_path
+        self.keyframe_interval = keyframe_interval
+        self.frame_count = frame_count
+        self.keyframe_due = True
+        if frame_count:
+            self.fh = self.open_frames(image_size, frame_count)
+        else:
+            self.fh = open(file_path, "wb")
+            self.fh.write(
+                FILE_HEADER.pack(
+                    DELTA_FILE_MAGIC, DELTA_FILE_VERSION, height, width
+                )
+            )
+        print(f"Writing delta frames to -> {file_path}")
+
+    def open_frames(self, image_size, frame_count: int):
+        reader = DeltaFrameReader(self.file_path)
+        if reader.image_size != tuple(image_size) or len(reader) < frame_count:
+            raise ValueError(
+                f"Can not continue {self.file_path} after {frame_count}"
+                f" frames, found {len(reader)} of size {reader.image_size}"
+            )
+        _, offset, length = reader.index[frame_count - 1]
+        fh = open(self.file_path, "r+b")
+        fh.truncate(offset + length)
+        fh.seek(offset + length)
+        return fh
+
+    def write(
+        self,
+        image: np.ndarray,
+        deltas: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    ):
+        """
+        Adds a frame, given the frame and the (ys, xs, color) batches of
+        pixels painted since the previous frame
+        """
+        if self.keyframe_due or self.frame_count % self.keyframe_interval == 0:
+            kind, payload = FrameKind.KEY, image.tobytes()
+            self.keyframe_due = False
+        else:
+            kind, payload = FrameKind.DELTA, get_delta_payload(deltas)
+        payload = zlib.compress(payload, COMPRESSION_LEVEL)
+        self.fh.write(RECORD_HEADER.pack(kind, self.frame_count, len(payload)))
+        self.fh.write(payload)
+        self.frame_count += 1
+
+    def flush(self):
+        self.fh.flush()
+
+    def close(self):
+        self.fh.close()
+        print(f"Wrote {self.frame_count} delta frames to -> {self.file_path}")
+
+
+def get_delta_payload(
+    deltas: Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]
+) -> bytes:
+    deltas = list(deltas)
+    if not deltas:
+        return COUNT.pack(0)
+    ys = np.concatenate([ys for ys, _, _ in deltas]).astype(np.uint16)
+    xs = np.concatenate([xs for _, xs, _ in deltas]).astype(np.uint16)
+    colors = np.concatenate(
+        [
+            np.broadcast_to(np.asarray(color, np.uint8), (len(ys), 3))
+            for ys, _, color in deltas
+        ]
+    )
+    return b"".join(
+        (COUNT.pack(len(ys)), ys.tobytes(), xs.tobytes(), colors.tobytes())
+    )
+
+
+class DeltaFrameReader:
+    """
+    Reconstructs any frame of a delta frames file, from the closest
+    keyframe before it. Sequential reads apply a single delta per frame.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        with open(file_path, "rb") as fh:
+            magic, version, self.height, self.width = FILE_HEADER.unpack(
+                fh.read(FILE_HEADER.size)
+            )
+            if magic != DELTA_FILE_MAGIC:
+                raise ValueError(f"Not a delta frames file -> {file_path}")
+            if version > DELTA_FILE_VERSION:
+                raise ValueError(
+                    f"Unsupported delta frames version {version} ->"
+                    f" {file_path}"
+                )
+        self.index = self.read_index()
+        self.keyframes = [
+            i
+            for i, (kind, _, _) in enumerate(self.index)
+            if kind == FrameKind.KEY
+        ]
+        self.frame = None
+        self.frame_index = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def image_size(self):
+        return self.height, self.width
+
+    def read_index(self) -> Iterator[Tuple[int, int, int]]:
+        """(kind, payload offset, payload length) of the complete records"""
+        index = []
+        file_size = os.path.getsize(self.file_path)
+        with open(self.file_path, "rb") as fh:
+            offset = FILE_HEADER.size
+            while offset + RECORD_HEADER.size <= file_size:
+                fh.seek(offset)
+                kind, _, length = RECORD_HEADER.unpack(
+                    fh.read(RECORD_HEADER.size)
+                )
+                offset += RECORD_HEADER.size
+                if offset + length > file_size:
+                    break
+                index.append((kind, offset, length))
+                offset += length
+        return index
+
+    def read_payload(self, fh, frame_index: int) -> bytes:
+        _, offset, length = self.index[frame_index]
+        fh.seek(offset)
+        return zlib.decompress(fh.read(length))
+
+    def apply(self, fh, frame_index: int):
+        kind, _, _ = self.index[frame_index]
+        payload = self.read_payload(fh, frame_index)
+        if kind == FrameKind.KEY:
+            self.frame = (
+                np.frombuffer(payload, np.uint8)
+                .reshape(self.height, self.width, 3)
+                .copy()
+            )
+        else:
+            (count,) = COUNT.unpack_from(payload)
+            ys = np.frombuffer(payload, np.uint16, count, COUNT.size)
+            xs = np.frombuffer(
+                payload, np.uint16, count, COUNT.size + 2 * count
+            )
+            colors = np.frombuffer(
+                payload, np.uint8, 3 * count, COUNT.size + 4 * count
+            ).reshape(count, 3)
+            self.frame[ys, xs] = colors
+        self.frame_index = frame_index
+
+    def get_frame(self, frame_index: int) -> np.ndarray:
+        """The (BGR)frame, the returned image is owned by the reader"""
+        frame_index = min(max(frame_index, 0), len(self) - 1)
+        if self.frame_index == frame_index:
+            return self.frame
+        keyframe = self.keyframes[
+            np.searchsorted(self.keyframes, frame_index, side="right") - 1
+        ]
+        start = keyframe
+        if self.frame_index is not None and (
+            keyframe <= self.frame_index < frame_index
+        ):
+            # continue from the current frame
+            start = self.frame_index + 1
+        with open(self.file_path, "rb") as fh:
+            for i in range(start, frame_index + 1):
+                self.apply(fh, i)
+        return self.frame
@@ -0,0 +1,154 @@
+import os
+from queue import Queue
+from threading import Thread
+
+import cv2
+import numpy as np
+from imageio_ffmpeg import write_frames
+
+from constants import (
+    FREEZE_LAST_FRAME_DURATION,
+    SNAPSHOT_WRITER_QUEUE_SIZE,
+    SNAPSHOT_WRITER_THREADS,
+    VIDEO_FRAME_RATE,
+    SnapshotFormat,
+)
+
+
+def get_imwrite_params(image_format: str, png_compression: int = None):
+    if image_format == SnapshotFormat.PNG and png_compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return []
+
+
+class SnapshotWriter:
+    """
+    Saves image snapshots in background threads, so that painting and
+    encoding overlap.
+    * frames are copied to a bounded queue, painting only waits when the
+      writers are queue_size frames behind
+    * snapshots that already exist are skipped, the directory is listed
+      once instead of checking every file
+    * png compression(0-9) trades size for speed, 'bmp' is not compressed
+    """
+
+    def __init__(
+        self,
+        target_dir: str,
+        image_format: str = SnapshotFormat.PNG,
+        png_compression: int = None,
+        threads: int = SNAPSHOT_WRITER_THREADS,
+        queue_size: int = SNAPSHOT_WRITER_QUEUE_SIZE,
+    ) -> None:
+        self.target_dir = target_dir
+        self.image_format = image_format
+        self.params = get_imwrite_params(image_format, png_compression)
+        self.existing = set(os.listdir(target_dir))
+        self.errors = []
+        self.queue = Queue(maxsize=queue_size)
+        self.threads = [
+            Thread(target=self.work, daemon=True) for _ in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, file_name: str, image: np.ndarray):
+        file_name = os.path.splitext(file_name)[0] + self.image_format
+        if file_name in self.existing:
+            return
+        self.existing.add(file_name)
+        file_path = os.path.join(self.target_dir, file_name)
+        self.queue.put((file_path, image.copy()))
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            file_path, image = item
+            try:
+                if not cv2.imwrite(file_path, image, self.params):
+                    self.errors.append(f"{file_path}: not written")
+            except Exception as e:
+                self.errors.append(f"{file_path}: {e}")
+            self.queue.task_done()
+
+    def flush(self):
+        """Waits for the snapshots queued so far to be saved"""
+        self.queue.join()
+
+    def close(self):
+        """Waits for the queued snapshots to be saved"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        for error in self.errors:
+            print(f"Failed to save snapshot {error}")
+
+
+class VideoStreamWriter:
+    """
+    Pipes (BGR)frames straight into an ffmpeg encoder, instead of saving
+    them as images to be encoded later.
+    * the video is encoded to a temporary file, moved to file_path only
+      when the stream is complete
+    * the last frame is frozen for freeze_duration seconds on close, as
+      MovieMaker does for image snapshots. The canvas written last is
+      referenced(not copied), the frozen frame is the canvas as closed
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        image_size,
+        frame_rate: int = VIDEO_FRAME_RATE,
+        freeze_duration: int = FREEZE_LAST_FRAME_DURATION,
+    ) -> None:
+        self.file_path = file_path
+        root, ext = os.path.splitext(file_path)
+        self.temp_file_path = f"{root}.{os.getpid()}.tmp{ext}"
+        self.frame_rate = frame_rate
+        self.freeze_duration = freeze_duration
+        self.frame_count = 0
+        self.last_frame = None
+        height, width = image_size
+        self.writer = write_frames(
+            self.temp_file_path,
+            (width, height),
+            pix_fmt_in="bgr24",
+            fps=frame_rate,
+            # yuv420p needs even dimensions, odd ones are padded(scaled)
+            macro_block_size=2,
+        )
+        self.writer.send(None)
+        print(f"Streaming frames to -> {file_path}")
+
+    def write(self, image: np.ndarray):
+        # the frame is piped right away, the canvas is not copied
+        self.last_frame = np.ascontiguousarray(image)
+        self.writer.send(self.last_frame)
+        self.frame_count += 1
+
+    def close(self, complete: bool = True):
+        """
+        Finishes the video, an incomplete stream(failed render) is
+        discarded, leaving any previous video in place
+        """
+        if not complete:
+            try:
+                self.writer.close()
+            except Exception as e:
+                # the render failed already, its error is the one raised
+                print(f"Failed to close the stream: {e}")
+            if os.path.exists(self.temp_file_path):
+                os.remove(self.temp_file_path)
+            print(f"Discarded the incomplete stream -> {self.file_path}")
+            return
+        if self.last_frame is not None:
+            for _ in range(int(self.freeze_duration * self.frame_rate)):
+                self.writer.send(self.last_frame)
+        self.writer.close()
+        os.replace(self.temp_file_path, self.file_path)
+        print(f"Streamed {self.frame_count} frames to -> {self.file_path}")
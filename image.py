@@ -1,7 +1,8 @@
 from functools import lru_cache
-from math import sqrt
 from random import choice, randint
-from typing import Iterator
+from typing import Iterator, Tuple
+
+import numpy as np
 
 from constants import Color
 
@@ -66,15 +67,77 @@ class Point:
 
 
 class ImageSegment:
+    """
+    Class representation of contiguously connected points with the same
+    color. The co-ordinates are held in contiguous integer arrays
+    (x's and y's), which may be views of a buffer shared by all segments.
+    """
+
     def __init__(
-        self, points: Iterator[Point] = None, base_color=None, color=None
+        self,
+        points: Iterator[Point] = None,
+        base_color=None,
+        color=None,
+        xs: np.ndarray = None,
+        ys: np.ndarray = None,
+        index: int = None,
     ) -> None:
-        self.points = points or []
+        if points:
+            xs = [point.x for point in points]
+            ys = [point.y for point in points]
+        self.xs = np.asarray(xs if xs is not None else (), dtype=np.int32)
+        self.ys = np.asarray(ys if ys is not None else (), dtype=np.int32)
         self.base_color = base_color
         self.color = color
+        # position of the segment in its image, its row of the statistics
+        self.index = index
+        # (2, capacity) points appended by add, xs/ys are views of it
+        self._buffer = None
+
+    def __len__(self) -> int:
+        return len(self.xs)
+
+    def __getstate__(self):
+        return {**self.__dict__, "_buffer": None}
+
+    def __setstate__(self, state):
+        # segments pickled before the array storage hold a list of points
+        points = state.pop("points", None)
+        state.setdefault("index", None)
+        state.setdefault("_buffer", None)
+        self.__dict__.update(state)
+        if points is not None:
+            self.xs = np.array([point.x for point in points], np.int32)
+            self.ys = np.array([point.y for point in points], np.int32)
+
+    @property
+    def points(self) -> Iterator[Point]:
+        """Points of the segment, built on demand from the arrays"""
+        return [
+            Point(x, y) for x, y in zip(self.xs.tolist(), self.ys.tolist())
+        ]
+
+    @property
+    def anchor(self) -> Point:
+        """First point of the segment in its current order"""
+        return Point(int(self.xs[0]), int(self.ys[0]))
 
     def add(self, point: Point, image):
-        self.points.append(point)
+        # appended to a buffer that grows geometrically, instead of copying
+        # the arrays on every point
+        size = len(self.xs)
+        buffer = self._buffer
+        if (
+            buffer is None
+            or self.xs.base is not buffer
+            or self.ys.base is not buffer
+            or size >= buffer.shape[1]
+        ):
+            buffer = np.empty((2, max(2 * size, 16)), np.int32)
+            buffer[0, :size], buffer[1, :size] = self.xs, self.ys
+            self._buffer = buffer
+        buffer[0, size], buffer[1, size] = point.x, point.y
+        self.xs, self.ys = buffer[0, : size + 1], buffer[1, : size + 1]
         if self.base_color is None:
             # print(f"Image Segment color->{image[point.y][point.x]}")
             self.set_base_color(image[point.y][point.x])
@@ -88,38 +151,52 @@ class ImageSegment:
     def is_eligible_for_coloring(self):
         return not self.is_black()
 
-    def randomize_color(self, color=None):
-        if self.is_eligible_for_coloring():
-            self.color = color or tuple([randint(50, 255) for _ in range(3)])
-        else:
+    def randomize_color(self, color=None, rng: np.random.Generator = None):
+        """Random color, drawn from rng(seeded) when given"""
+        if not self.is_eligible_for_coloring():
             self.color = self.base_color
+        elif color is not None:
+            self.color = color
+        elif rng is not None:
+            self.color = tuple(rng.integers(50, 256, size=3).tolist())
+        else:
+            self.color = tuple([randint(50, 255) for _ in range(3)])
 
-    def sort_x(self) -> Iterator[Point]:
-        def comparator(point: Point) -> int:
-            return point.x
+    def sort(self, key: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Stable sort of the points by the given per point key"""
+        order = np.argsort(key, kind="stable")
+        self.xs, self.ys = self.xs[order], self.ys[order]
+        return self.xs, self.ys
+
+    def sort_x_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.sort(key=self.xs)
+
+    def sort_y_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.sort(key=self.ys)
 
-        self.points = sorted(self.points, key=comparator)
+    def sort_avg_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        # (x + y) / 2 orders the points the same as x + y
+        return self.sort(key=self.xs.astype(np.int64) + self.ys)
+
+    def sort_distance_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        # sqrt(x**2 + y**2) orders the points the same as x**2 + y**2
+        xs, ys = self.xs.astype(np.int64), self.ys.astype(np.int64)
+        return self.sort(key=xs**2 + ys**2)
+
+    def sort_x(self) -> Iterator[Point]:
+        self.sort_x_arrays()
         return self.points
 
     def sort_y(self) -> Iterator[Point]:
-        def comparator(point: Point) -> int:
-            return point.y
-
-        self.points = sorted(self.points, key=comparator)
+        self.sort_y_arrays()
         return self.points
 
     def sort_avg(self) -> Iterator[Point]:
-        def comparator(point: Point) -> int:
-            return (point.x + point.y) / 2
-
-        self.points = sorted(self.points, key=comparator)
+        self.sort_avg_arrays()
         return self.points
 
     def sort_distance(self) -> Iterator[Point]:
-        def comparator(point: Point) -> int:
-            return sqrt(point.x**2 + point.y**2)
-
-        self.points = sorted(self.points, key=comparator)
+        self.sort_distance_arrays()
         return self.points
 
     ###implement others as needed
@@ -1,28 +1,68 @@
 from __future__ import annotations
 
 import os
-import pickle
-from copy import deepcopy
-from time import time
-from typing import Iterator
+from functools import partial
+from typing import Iterator, Tuple
 
 import click
 import cv2
 import numpy as np
 
-from constants import LOG_LIMIT, REFERENCE_FILENAME
+from coloring import PALETTE_NAMES, color_segments
+from constants import (
+    BINARY_EXTENSIONS,
+    BINARY_THRESHOLD,
+    DEFAULT_CONNECTIVITY,
+    DEFAULT_SEED,
+    LEGACY_REFERENCE_FILENAME,
+    LOG_LIMIT,
+    MAX_IMAGE_SIZE,
+    PALETTE_EXTENSION,
+    PREVIEW_IMAGE_SIZE,
+    REFERENCE_FILENAME,
+    SEGMENT_CACHE_MAX_BYTES,
+    SEGMENT_CACHE_PATH,
+    Color,
+    Segmentation,
+    Threshold,
+)
 from image import ImageSegment, get_point
+from segment_cache import SegmentCache
+from segment_stats import SegmentStats, get_segment_stats
+from segment_store import (
+    is_segment_file,
+    load_pickle,
+    read_segment_file,
+    write_segment_file,
+)
 from utils import (
     get_filename_from_path,
-    get_image_binary,
-    get_image_grayscale,
-    get_image_resize,
+    get_flood_order,
     get_image_size,
+    get_label_map,
     get_target_dir_binary,
     get_target_dir_result,
+    parallel_map,
+    preprocess_image,
+    read_image,
 )
 
 
+def get_color_table(colors) -> np.ndarray:
+    """(segments, 3) uint8 table of grayscale or BGR colors"""
+    table = np.zeros((len(colors), 3), np.uint8)
+    for i, color in enumerate(colors):
+        table[i] = color
+    return table
+
+
+def get_base_file_path(file_path: str, segment_file: dict) -> str:
+    """Path of the base segment file a palette file references"""
+    return os.path.normpath(
+        os.path.join(os.path.dirname(file_path), segment_file["meta"]["base"])
+    )
+
+
 class AutoImageDraw:
     """
     Class to represent an image in its individual components
@@ -35,7 +75,13 @@ class AutoImageDraw:
         image: np.ndarray = None,
         image_segments: Iterator[ImageSegment] = None,
         image_size: Iterator[int] = None,
+        max_size: int = MAX_IMAGE_SIZE,
+        threshold: int = BINARY_THRESHOLD,
+        threshold_method: str = Threshold.FIXED,
     ) -> None:
+        self.max_size = max_size
+        self.threshold = threshold
+        self.threshold_method = threshold_method
         self.image = (
             self.preprocess_image(image=image) if not image is None else None
         )
@@ -45,15 +91,129 @@ class AutoImageDraw:
             else image_size
         )
         self.log_ctr = (self.image_height * self.image_width) // LOG_LIMIT
-        self.image_segments = image_segments or []
+        # image segments are built on first access, when backed by a file
+        self.image_segments = image_segments
+        self.segment_file = None
+        self.palette = None
+        self.label_map = None
+        # per segment statistics, computed once(see segment_stats.py)
+        self._stats = None
         print(f"Image height/width->{self.image_height}/{self.image_width}")
 
+    def __setstate__(self, state):
+        # pickled before the segments were (lazily) backed by a file
+        if "image_segments" in state:
+            state["_image_segments"] = state.pop("image_segments")
+        self.__dict__.update(
+            {
+                "segment_file": None,
+                "palette": None,
+                "label_map": None,
+                "_stats": None,
+            }
+        )
+        self.__dict__.update(state)
+        self.image_segments = self._image_segments
+
+    @property
+    def image_segments(self) -> Iterator[ImageSegment]:
+        if self._image_segments is None:
+            self._image_segments = self.build_image_segments()
+        return self._image_segments
+
+    @image_segments.setter
+    def image_segments(self, image_segments: Iterator[ImageSegment]):
+        # the index of a segment is its position, as in the segment file
+        for i, image_segment in enumerate(image_segments or []):
+            image_segment.index = i
+        self._image_segments = image_segments
+
+    def build_image_segments(self) -> Iterator[ImageSegment]:
+        """
+        Builds the image segments from the segment file, colored with
+        the palette(if any)
+        """
+        if self.segment_file is None:
+            return []
+        sections = self.segment_file["sections"]
+        offsets = sections["offsets"].tolist()
+        xs, ys = sections["xs"], sections["ys"]
+        base_colors = sections["base_colors"]
+        colors = self.palette
+        if colors is None:
+            colors = sections.get("colors")
+        return [
+            ImageSegment(
+                xs=xs[start:stop],
+                ys=ys[start:stop],
+                base_color=base_colors[i],
+                color=colors[i] if colors is not None else None,
+                index=i,
+            )
+            for i, (start, stop) in enumerate(zip(offsets, offsets[1:]))
+        ]
+
+    @property
+    def base_colors(self) -> np.ndarray:
+        """(segments, 3) table of the base colors"""
+        if self.segment_file is not None:
+            return self.segment_file["sections"]["base_colors"]
+        return get_color_table(
+            [segment.base_color for segment in self.image_segments]
+        )
+
+    @property
+    def colorable(self) -> np.ndarray:
+        """Segments that are colored, all but the outline(black) ones"""
+        return ~(self.base_colors == Color.BLACK).all(axis=1)
+
+    @property
+    def stats(self) -> SegmentStats:
+        """
+        Per segment statistics, as saved in the segment file or computed
+        (once) from the segments
+        """
+        if self._stats is None and self.segment_file is not None:
+            self._stats = SegmentStats.from_sections(
+                self.segment_file["sections"]
+            )
+        if self._stats is None:
+            self._stats = self.build_stats()
+        return self._stats
+
+    @property
+    def adjacency(self) -> np.ndarray:
+        """(pairs, 2) neighbouring colorable segments"""
+        return self.stats.adjacency
+
+    def build_stats(self) -> SegmentStats:
+        image_segments = self.image_segments
+        offsets = np.zeros(len(image_segments) + 1, np.int64)
+        np.cumsum(
+            [len(segment) for segment in image_segments], out=offsets[1:]
+        )
+        empty = np.zeros(0, np.int32)
+        label_map = self.label_map
+        if label_map is None:
+            label_map = self.build_label_map()
+        return get_segment_stats(
+            label_map=label_map,
+            offsets=offsets,
+            xs=np.concatenate([empty] + [s.xs for s in image_segments]),
+            ys=np.concatenate([empty] + [s.ys for s in image_segments]),
+            colorable=self.colorable,
+        )
+
     def preprocess_image(self, image: np.ndarray) -> np.ndarray:
         print("Preprocessing image")
-        image = get_image_resize(image=image)
-        image = get_image_grayscale(image=image)
+        image = preprocess_image(
+            image=image,
+            max_size=self.max_size,
+            threshold=self.threshold,
+            threshold_method=self.threshold_method,
+        )
         print("Preprocessing image complete")
-        return get_image_binary(image=image)
+        return image
 
     @property
     def k_segments(self):
@@ -79,12 +239,65 @@ class AutoImageDraw:
             f" Image segments:{len(self.image_segments)}"
         )
 
-    def process_image(self, image: np.ndarray = None):
+    def process_image(
+        self,
+        image: np.ndarray = None,
+        engine: str = None,
+        connectivity: int = DEFAULT_CONNECTIVITY,
+    ):
         """
-        Saves the pkl file of the image as ImageSegments(and Points)
+        Identifies the ImageSegments(and Points) of the image, and computes
+        their statistics
+        * 'label' engine labels the whole image in a single pass
+        * 'flood' engine is the (slow) reference flood fill
         """
-        seen = {}
+        engine = engine or Segmentation.LABEL
         image = image if image is not None else self.image
+        if engine == Segmentation.FLOOD:
+            self.process_image_flood(image=image, connectivity=connectivity)
+        elif engine == Segmentation.LABEL:
+            self.process_image_label(image=image, connectivity=connectivity)
+        else:
+            raise ValueError(f"Unknown segmentation engine -> {engine}")
+        self._stats = self.build_stats()
+
+    def process_image_label(
+        self, image: np.ndarray, connectivity: int = DEFAULT_CONNECTIVITY
+    ):
+        """
+        Populates the ImageSegments from the label map of the image
+        """
+        label_map, count = get_label_map(
+            image=image, connectivity=connectivity
+        )
+        # the pixels of a segment are painted in the order the flood fill
+        # visits them
+        order, offsets = get_flood_order(
+            label_map, count=count, connectivity=connectivity
+        )
+        # one shared co-ordinate buffer, segments hold views of it
+        ys, xs = np.divmod(order.astype(np.int32), self.image_width)
+        log_ctr = max(count // LOG_LIMIT, 1)
+        for label in range(count):
+            start, stop = offsets[label], offsets[label + 1]
+            image_segment = ImageSegment(
+                xs=xs[start:stop],
+                ys=ys[start:stop],
+                base_color=image[ys[start]][xs[start]],
+                index=label,
+            )
+            self.image_segments.append(image_segment)
+            if (label + 1) % log_ctr == 0:
+                print(f"Processed {stop} of {len(order)}...")
+        self.label_map = label_map
+
+    def process_image_flood(
+        self, image: np.ndarray, connectivity: int = DEFAULT_CONNECTIVITY
+    ):
+        """
+        Reference segmentation, flood fills the image one pixel at a time
+        """
+        seen = {}
         total = self.image_width * self.image_height
         for x in range(0, self.image_width):
             for y in range(0, self.image_height):
@@ -93,7 +306,7 @@ class AutoImageDraw:
                     continue
                 # print(f"ROOT:{curr}")
                 to_process = [curr]
-                image_segment = ImageSegment()
+                xs, ys = [], []
                 while to_process:
                     curr = to_process.pop()
                     if (curr.y, curr.x) in seen:
@@ -103,81 +316,307 @@ class AutoImageDraw:
                         max_x=self.image_width,
                         max_y=self.image_height,
                         image=image,
+                        connectivity=connectivity,
                         similar=True,
                     )
                     to_process.extend(neighbors)
-                    image_segment.add(curr, image=image)
+                    xs.append(curr.x)
+                    ys.append(curr.y)
                     # print(f"to process->{len(to_process)}:{len(seen)}")
+                image_segment = ImageSegment(
+                    xs=xs,
+                    ys=ys,
+                    base_color=image[ys[0]][xs[0]],
+                    index=len(self.image_segments),
+                )
                 self.image_segments.append(image_segment)
                 if len(seen) % self.log_ctr == 0:
                     print(f"Processed {len(seen)} of {total}...")
 
     def create_versions(
-        self, target_dir_binary: str, image_path=None, versions=None
+        self,
+        target_dir_binary: str,
+        image_path=None,
+        versions=None,
+        base_file_path: str = None,
+        workers: int = 1,
+        seed: int = DEFAULT_SEED,
+        palette_name: str = None,
     ):
         """
-        Creates colored versions of the image and saved them as pkl files
+        Creates colored versions of the image and saves them as palette
+        files, referencing the geometry of the base segment file
+        * version i is colored with the seed 'seed + i', which names the
+          file, versions that exist already are not created again
+        * with a palette_name, neighbouring segments get colors of the
+          named palette that are apart(see coloring.py)
+        * with workers > 1 the versions are split across a process pool
         """
         versions = versions or self.versions
+        base_file_path = base_file_path or os.path.join(
+            target_dir_binary, REFERENCE_FILENAME
+        )
         filename = get_filename_from_path(image_path, include_ext=False)
-        for _ in range(versions):
-            filename_version = filename + f"_{int(time()*1000)}.pkl"
-            self.save(
-                aid=self.create_version(),
-                filename=filename_version,
-                target_dir_binary=target_dir_binary,
+        if palette_name is not None:
+            filename = f"{filename}_{palette_name}"
+        jobs = []
+        for version_seed in range(seed, seed + versions):
+            file_path = os.path.join(
+                target_dir_binary,
+                f"{filename}_seed{version_seed}{PALETTE_EXTENSION}",
+            )
+            if os.path.exists(file_path):
+                print(f"Version exists -> {file_path}")
+                continue
+            jobs.append((file_path, version_seed))
+        if workers <= 1:
+            self.save_palettes(
+                jobs=jobs,
+                base_file_path=base_file_path,
+                palette_name=palette_name,
             )
+            return
+        batches = [jobs[i::workers] for i in range(workers)]
+        results = parallel_map(
+            partial(
+                create_palette_files,
+                base_file_path=base_file_path,
+                palette_name=palette_name,
+            ),
+            [batch for batch in batches if batch],
+            workers=workers,
+        )
+        for i, error in enumerate(results):
+            if error:
+                print(f"Failed to create versions (batch {i+1}): {error}")
 
-    def create_version(self) -> AutoImageDraw:
+    def save_palettes(
+        self,
+        jobs: Iterator[Tuple[str, int]],
+        base_file_path: str,
+        palette_name: str = None,
+    ):
+        """Creates and saves the palette of every (file path, seed)"""
+        for file_path, seed in jobs:
+            self.save_palette(
+                palette=self.create_palette(
+                    seed=seed, palette_name=palette_name
+                ),
+                file_path=file_path,
+                base_file_path=base_file_path,
+                seed=seed,
+            )
+
+    def create_palette(
+        self, seed: int = None, palette_name: str = None
+    ) -> np.ndarray:
+        """
+        Random colors of a version, (segments, 3). The same seed gives the
+        same colors. Outline(black) segments keep the base color.
+        * without a palette_name the colors are independent, drawn in one
+          vectorized draw
+        * otherwise neighbouring segments get colors of the named palette
+          that are apart
+        """
+        rng = np.random.default_rng(seed)
+        base_colors = self.base_colors
+        colorable = self.colorable
+        if palette_name is not None:
+            return color_segments(
+                adjacency=self.adjacency,
+                base_colors=base_colors,
+                colorable=colorable,
+                rng=rng,
+                palette_name=palette_name,
+            )
+        palette = rng.integers(
+            50, 256, size=(len(base_colors), 3), dtype=np.uint8
+        )
+        palette[~colorable] = base_colors[~colorable]
+        return palette
+
+    def create_version(
+        self, seed: int = None, palette_name: str = None
+    ) -> AutoImageDraw:
+        return self.with_palette(
+            palette=self.create_palette(seed=seed, palette_name=palette_name)
+        )
+
+    def with_palette(self, palette: np.ndarray) -> AutoImageDraw:
+        """
+        Colored version sharing the geometry(no copies) of this image
+        """
         aid = AutoImageDraw(
             image=None,
-            image_segments=deepcopy(self.image_segments),
             image_size=(self.image_height, self.image_width),
         )
-        for image_segment in aid.image_segments:
-            image_segment.randomize_color()
-
+        aid.label_map = self.label_map
+        aid.palette = palette
+        aid._stats = self._stats
+        if self.segment_file is not None:
+            aid.segment_file = self.segment_file
+        else:
+            aid.image_segments = [
+                ImageSegment(
+                    xs=image_segment.xs,
+                    ys=image_segment.ys,
+                    base_color=image_segment.base_color,
+                    color=palette[i],
+                    index=i,
+                )
+                for i, image_segment in enumerate(self.image_segments)
+            ]
         return aid
 
+    def save_palette(
+        self,
+        palette: np.ndarray,
+        file_path: str,
+        base_file_path: str,
+        seed: int = None,
+    ):
+        """
+        Saves the colors of a version, one per segment, as a palette file
+        """
+        write_segment_file(
+            file_path=file_path,
+            image_size=(self.image_height, self.image_width),
+            sections={"colors": palette},
+            meta={
+                "base": os.path.relpath(
+                    base_file_path, os.path.dirname(file_path)
+                ),
+                "seed": seed,
+            },
+        )
+
     def save(
         self, aid, filename, target_dir_binary=None, variation=True
     ) -> AutoImageDraw:
         """
-        Genereates a new version of the base pkl file
-        Colors the image in binary(pkl) format
+        Genereates a new version of the base segment file
+        Colors the image in binary(segment file) format
         Saves it as a new file
         """
-        with open(os.path.join(target_dir_binary, filename), "wb") as fh:
-            pickle.dump(aid, fh)
-            print(f"Saved binary to -> {fh.name}")
+        AutoImageDraw.write(
+            aid=aid, file_path=os.path.join(target_dir_binary, filename)
+        )
         return aid
 
+    @staticmethod
+    def write(aid: AutoImageDraw, file_path: str):
+        """
+        Writes the image segments as a (memory mappable) segment file
+        """
+        image_segments = aid.image_segments
+        offsets = np.zeros(len(image_segments) + 1, np.int64)
+        np.cumsum(
+            [len(segment) for segment in image_segments], out=offsets[1:]
+        )
+        empty = np.zeros(0, np.int32)
+        sections = {
+            "label_map": aid.build_label_map(),
+            "offsets": offsets,
+            "xs": np.concatenate([empty] + [s.xs for s in image_segments]),
+            "ys": np.concatenate([empty] + [s.ys for s in image_segments]),
+            "base_colors": get_color_table(
+                [segment.base_color for segment in image_segments]
+            ),
+            **aid.stats.sections,
+        }
+        colors = [segment.color for segment in image_segments]
+        if all(color is not None for color in colors):
+            sections["colors"] = get_color_table(colors)
+        write_segment_file(
+            file_path=file_path,
+            image_size=(aid.image_height, aid.image_width),
+            sections=sections,
+        )
+
+    def build_label_map(self) -> np.ndarray:
+        """Segment index of every pixel, in the order of image_segments"""
+        label_map = np.zeros((self.image_height, self.image_width), np.int32)
+        for i, image_segment in enumerate(self.image_segments):
+            label_map[image_segment.ys, image_segment.xs] = i
+        return label_map
+
     @classmethod
-    def load(self, file_path=None) -> AutoImageDraw:
+    def load(self, file_path=None, base_aids: dict = None) -> AutoImageDraw:
         """
-        Reads the (binary)pkl file to be loaded as a python 'AutoImageDraw' object
+        Reads the binary file to be loaded as a python 'AutoImageDraw' object
+        * segment files are memory mapped
+        * palette files are applied(lazily) to the base segment file,
+          base_aids caches the loaded base by its path
+        * (legacy) pkl files are unpickled
         """
         print(f"Loading {file_path}")
-        with open(file_path, "rb") as fh:
-            aid = pickle.load(fh)
-            print("Loading complete")
-            return aid
+        if not is_segment_file(file_path):
+            aid = load_pickle(file_path)
+        else:
+            segment_file = read_segment_file(file_path)
+            if segment_file["meta"].get("base") is None:
+                aid = AutoImageDraw.from_segment_file(segment_file)
+            else:
+                base_aid = AutoImageDraw.load_base(
+                    file_path=get_base_file_path(file_path, segment_file),
+                    base_aids=base_aids,
+                )
+                aid = base_aid.with_palette(
+                    palette=segment_file["sections"]["colors"]
+                )
+        print("Loading complete")
+        return aid
 
-    def repaint(self, target_dir, target_filename):
+    @classmethod
+    def load_base(self, file_path, base_aids: dict = None) -> AutoImageDraw:
+        base_aids = base_aids if base_aids is not None else {}
+        if file_path not in base_aids:
+            base_aids[file_path] = AutoImageDraw.load(file_path=file_path)
+        return base_aids[file_path]
+
+    @classmethod
+    def from_segment_file(self, segment_file: dict) -> AutoImageDraw:
+        aid = AutoImageDraw(image=None, image_size=segment_file["image_size"])
+        aid.segment_file = segment_file
+        aid.label_map = segment_file["sections"]["label_map"]
+        return aid
+
+    def repaint(self, target_dir, target_filename, palette=None):
         """
-        Given a pkl file, saves it as an image in given path
+        Given a segment file(or a palette of it), saves it as an image
+        in given path
         """
         filepath = os.path.join(target_dir, target_filename)
-        image = self.create_image()
+        image = self.create_image(palette=palette)
         print(f"Saved image to -> {filepath}")
         cv2.imwrite(filepath, image)
 
-    def create_image(self):
-        image = np.zeros((self.image_height, self.image_width, 3), np.uint8)
-        for image_segment in self.image_segments:
-            for point in image_segment.points:
-                image[point.y][point.x] = image_segment.color
-        return image
+    def get_palette(self) -> np.ndarray:
+        """(segments, 3) table of the segment colors"""
+        if self._image_segments is None:
+            # segments were not built(or changed), the colors are as loaded
+            if self.palette is not None:
+                return self.palette
+            return self.segment_file["sections"]["colors"]
+        return get_color_table(
+            [image_segment.color for image_segment in self.image_segments]
+        )
+
+    def create_image(self, palette: np.ndarray = None) -> np.ndarray:
+        """
+        Renders the image by looking up the segment colors(palette)
+        through the label map
+        """
+        if palette is None:
+            palette = self.get_palette()
+        if self.label_map is None:
+            image = np.zeros(
+                (self.image_height, self.image_width, 3), np.uint8
+            )
+            for image_segment, color in zip(self.image_segments, palette):
+                image[image_segment.ys, image_segment.xs] = color
+            return image
+        return np.take(palette, self.label_map, axis=0)
 
     def run(
         self,
@@ -186,63 +625,236 @@ class AutoImageDraw:
         image_path: str = None,
         base_pkl_path: str = None,
         versions: int = None,
+        engine: str = None,
+        connectivity: int = DEFAULT_CONNECTIVITY,
+        workers: int = 1,
+        cache: SegmentCache = None,
+        seed: int = DEFAULT_SEED,
+        palette_name: str = None,
     ):
         reference_file_path = base_pkl_path or os.path.join(
             target_dir_binary, REFERENCE_FILENAME
         )
+        legacy_reference_file_path = os.path.join(
+            target_dir_binary, LEGACY_REFERENCE_FILENAME
+        )
+        if not os.path.exists(reference_file_path) and os.path.exists(
+            legacy_reference_file_path
+        ):
+            reference_file_path = legacy_reference_file_path
         if os.path.exists(reference_file_path):
             print(
                 f"Base binary exists -> {reference_file_path}. Will skip base"
                 " processing"
             )
             aid = AutoImageDraw.load(file_path=reference_file_path)
-            self.image_segments = deepcopy(aid.image_segments)
+            # versions only hold colors, the geometry is shared
+            self.segment_file = aid.segment_file
+            self.label_map = aid.label_map
+            self.image_segments = (
+                aid.image_segments if aid.segment_file is None else None
+            )
         else:
             target_filename = target_filename or REFERENCE_FILENAME
-            binary_image = get_image_binary(self.image)
-            self.process_image(image=binary_image)
-            self.save(
-                aid=self,
-                filename=target_filename,
-                variation=False,
-                target_dir_binary=target_dir_binary,
+            # the image is binary since preprocessing
+            binary_image = self.image
+            cache = cache or SegmentCache()
+            cache_key = cache.get_key(
+                binary_image,
+                engine=engine or Segmentation.LABEL,
+                # the label engine stored the points in x major order
+                # before, those segment files are not reused
+                point_order=Segmentation.FLOOD,
+                connectivity=connectivity,
+                threshold=self.threshold,
+                threshold_method=self.threshold_method,
             )
+            target_file_path = os.path.join(target_dir_binary, target_filename)
+            if cache.fetch(key=cache_key, target_file_path=target_file_path):
+                aid = AutoImageDraw.load(file_path=target_file_path)
+                self.segment_file = aid.segment_file
+                self.label_map = aid.label_map
+                self.image_segments = None
+            else:
+                self.process_image(
+                    image=binary_image,
+                    engine=engine,
+                    connectivity=connectivity,
+                )
+                self.save(
+                    aid=self,
+                    filename=target_filename,
+                    variation=False,
+                    target_dir_binary=target_dir_binary,
+                )
+                cache.put(key=cache_key, file_path=target_file_path)
 
         self.create_versions(
             versions=versions or self.versions,
             image_path=image_path,
             target_dir_binary=target_dir_binary,
+            base_file_path=reference_file_path,
+            workers=workers,
+            seed=seed,
+            palette_name=palette_name,
         )
 
 
-def create_variations(image_path, count):
-    image = cv2.imread(image_path)
-    target_dir_binary = get_target_dir_binary(image_path)
-    aid = AutoImageDraw(image=image)
+# base images loaded by the (worker) process, by path
+WORKER_BASE_AIDS = {}
+
+
+def create_palette_files(
+    jobs: Iterator[Tuple[str, int]],
+    base_file_path: str,
+    palette_name: str = None,
+):
+    """
+    Creates the palette files of a batch of (file path, seed) versions,
+    returns the error
+    """
+    try:
+        base_aid = AutoImageDraw.load_base(
+            file_path=base_file_path, base_aids=WORKER_BASE_AIDS
+        )
+        base_aid.save_palettes(
+            jobs=jobs, base_file_path=base_file_path, palette_name=palette_name
+        )
+    except Exception as e:
+        return str(e)
+
+
+def render_batch(batch, target_dir: str) -> Iterator[str]:
+    """
+    Renders a batch of binary files, returns the error of every file. The
+    palette files of a batch share a base, loaded once for the batch.
+    """
+    base_file_path, files = batch
+    if base_file_path:
+        print(f"Rendering {len(files)} palettes of {base_file_path}")
+    base_aid, errors = None, []
+    for bin_filename, palette in files:
+        try:
+            if base_file_path is None:
+                aid = AutoImageDraw.load(bin_filename)
+            else:
+                base_aid = base_aid or AutoImageDraw.load(base_file_path)
+                aid = base_aid
+            aid.repaint(
+                target_filename=f"{get_filename_from_path(bin_filename)}.png",
+                target_dir=target_dir,
+                palette=palette,
+            )
+            errors.append(None)
+        except Exception as e:
+            errors.append(str(e))
+    return errors
+
+
+def get_render_batches(bin_filenames: Iterator[str], workers: int = 1):
+    """
+    (base file path, [(binary file, palette)]) batches, the palette files
+    are grouped by their base, the other files are batched on their own.
+    The files of a base are split over the workers left per base.
+    """
+    bases, batches = {}, []
+    for bin_filename in bin_filenames:
+        base_file_path = None
+        if bin_filename.endswith(PALETTE_EXTENSION):
+            try:
+                segment_file = read_segment_file(bin_filename)
+                base_file_path = get_base_file_path(bin_filename, segment_file)
+            except Exception:
+                # unreadable, rendered on its own to report the error
+                pass
+        if base_file_path is None:
+            batches.append((None, [(bin_filename, None)]))
+            continue
+        bases.setdefault(base_file_path, []).append(
+            (bin_filename, segment_file["sections"]["colors"])
+        )
+    splits = max(workers // max(len(bases), 1), 1)
+    for base_file_path, files in bases.items():
+        batches.extend(
+            (base_file_path, files[i::splits])
+            for i in range(min(splits, len(files)))
+        )
+    return batches
+
+
+def create_variations(
+    image_path,
+    count,
+    engine=None,
+    connectivity=DEFAULT_CONNECTIVITY,
+    workers=1,
+    cache=None,
+    max_size=MAX_IMAGE_SIZE,
+    threshold=BINARY_THRESHOLD,
+    threshold_method=Threshold.FIXED,
+    seed=DEFAULT_SEED,
+    palette_name=None,
+    preview=False,
+):
+    """
+    Creates the versions of an image, a preview segments the image at
+    (most)PREVIEW_IMAGE_SIZE, in its own directory
+    """
+    if preview:
+        max_size = min(max_size, PREVIEW_IMAGE_SIZE)
+    image = read_image(image_path, max_size=max_size)
+    if image is None:
+        raise ValueError(f"Unable to read image -> {image_path}")
+    target_dir_binary = get_target_dir_binary(image_path, preview=preview)
+    aid = AutoImageDraw(
+        image=image,
+        max_size=max_size,
+        threshold=threshold,
+        threshold_method=threshold_method,
+    )
     aid.run(
         versions=count,
         image_path=image_path,
         target_dir_binary=target_dir_binary,
+        engine=engine,
+        connectivity=connectivity,
+        workers=workers,
+        cache=cache,
+        seed=seed,
+        palette_name=palette_name,
     )
 
 
-def render_variations(image_path, source_dir_binary):
-    target_dir = get_target_dir_result(image_path)
-    bin_filenames = [
+def render_variations(image_path, source_dir_binary, workers=1, preview=False):
+    """
+    Renders the versions in source_dir_binary, that are not rendered yet
+    * the palette files of a base are rendered in a batch, from the base
+      loaded once
+    * with workers > 1 the batches are rendered in a process pool
+    """
+    target_dir = get_target_dir_result(image_path, preview=preview)
+    bin_filenames = sorted(
         os.path.join(source_dir_binary, filename)
         for filename in os.listdir(source_dir_binary)
-        if filename.endswith(".pkl") and filename != REFERENCE_FILENAME
-    ]
-    for i, bin_finename in enumerate(bin_filenames):
-        aid: AutoImageDraw = AutoImageDraw.load(bin_finename)
-        filename = get_filename_from_path(bin_finename)
-        try:
-            filename = f"{filename}.png"
-            if not os.path.exists(os.path.join(target_dir, filename)):
-                print(f"Processing {i+1} of {len(bin_filenames)}")
-                aid.repaint(target_filename=filename, target_dir=target_dir)
-        except Exception as e:
-            print(f"Failed to repaint {filename}: {e}")
+        if filename.endswith(BINARY_EXTENSIONS)
+        and filename not in (REFERENCE_FILENAME, LEGACY_REFERENCE_FILENAME)
+        and not os.path.exists(os.path.join(target_dir, f"{filename}.png"))
+    )
+    batches = get_render_batches(bin_filenames, workers=workers)
+    results = parallel_map(
+        partial(render_batch, target_dir=target_dir),
+        batches,
+        workers=workers,
+    )
+    processed = 0
+    for (_, files), errors in zip(batches, results):
+        for (bin_filename, _), error in zip(files, errors):
+            filename = f"{get_filename_from_path(bin_filename)}.png"
+            processed += 1
+            if error:
+                print(f"Failed to repaint {filename}: {error}")
+            else:
+                print(f"Processed {processed} of {len(bin_filenames)}")
 
 
 @click.command()
@@ -262,15 +874,140 @@ def render_variations(image_path, source_dir_binary):
     default=1,
     help="Total count of random images to be generated.",
 )
-def run(image_path, target_dir, versions):
+@click.option(
+    "--engine",
+    required=False,
+    type=click.Choice((Segmentation.LABEL, Segmentation.FLOOD)),
+    default=Segmentation.LABEL,
+    help=(
+        "Segmentation engine. 'label' labels the image in a single pass."
+        " 'flood' is the reference (slow) flood fill."
+    ),
+)
+@click.option(
+    "--connectivity",
+    required=False,
+    type=click.Choice(("4", "8")),
+    default=str(DEFAULT_CONNECTIVITY),
+    help="Pixel connectivity used to identify image segments.",
+)
+@click.option(
+    "--workers",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1,
+    help="Processes used to create and render the versions.",
+)
+@click.option(
+    "--cache-dir",
+    required=False,
+    type=str,
+    default=SEGMENT_CACHE_PATH,
+    help="Directory of the content addressed segmentation cache.",
+)
+@click.option(
+    "--cache-size",
+    required=False,
+    type=click.IntRange(min=0),
+    default=SEGMENT_CACHE_MAX_BYTES // 1024**2,
+    help="Size bound(MB) of the segmentation cache, 0 disables it.",
+)
+@click.option(
+    "--max-size",
+    required=False,
+    type=click.IntRange(min=1),
+    default=MAX_IMAGE_SIZE,
+    help="Longest side(pixels) the image is downscaled to.",
+)
+@click.option(
+    "--threshold",
+    required=False,
+    type=click.IntRange(min=0, max=255),
+    default=BINARY_THRESHOLD,
+    help="Threshold to binarize the image with the 'fixed' method.",
+)
+@click.option(
+    "--threshold-method",
+    required=False,
+    type=click.Choice((Threshold.FIXED, Threshold.OTSU, Threshold.ADAPTIVE)),
+    default=Threshold.FIXED,
+    help="Method used to binarize the image.",
+)
+@click.option(
+    "--seed",
+    required=False,
+    type=click.IntRange(min=0),
+    default=DEFAULT_SEED,
+    help=(
+        "Seed of the first version's colors, version i uses seed + i. The"
+        " same seed gives the same versions."
+    ),
+)
+@click.option(
+    "--palette",
+    required=False,
+    type=click.Choice(PALETTE_NAMES),
+    default=None,
+    help=(
+        "Colors neighbouring segments apart, with the colors of the named"
+        " palette('random' for any color). Independent random colors by"
+        " default."
+    ),
+)
+@click.option(
+    "--preview",
+    required=False,
+    is_flag=True,
+    default=False,
+    help=(
+        "Creates the versions at a reduced size(--max-size of at most"
+        f" {PREVIEW_IMAGE_SIZE}), to review them fast. They are kept in"
+        " the 'preview' directory of the image."
+    ),
+)
+def run(
+    image_path,
+    target_dir,
+    versions,
+    engine,
+    connectivity,
+    workers,
+    cache_dir,
+    cache_size,
+    max_size,
+    threshold,
+    threshold_method,
+    seed,
+    palette,
+    preview,
+):
     """
     Random Image (version)generator given a source image.
     """
-    # needed to load the pkl file
-    from image import Point
-
-    create_variations(image_path=image_path, count=versions)
-    render_variations(image_path=image_path, source_dir_binary=target_dir)
+    create_variations(
+        image_path=image_path,
+        count=versions,
+        engine=engine,
+        connectivity=int(connectivity),
+        workers=workers,
+        cache=SegmentCache(
+            cache_dir=cache_dir, max_bytes=cache_size * 1024**2
+        ),
+        max_size=max_size,
+        threshold=threshold,
+        threshold_method=threshold_method,
+        seed=seed,
+        palette_name=palette,
+        preview=preview,
+    )
+    if preview:
+        target_dir = get_target_dir_binary(image_path, preview=True)
+    render_variations(
+        image_path=image_path,
+        source_dir_binary=target_dir,
+        workers=workers,
+        preview=preview,
+    )
 
 
 if __name__ == "__main__":
@@ -1,14 +1,13 @@
 import os
+from functools import partial
 from glob import glob
-from typing import Iterator
+from typing import Iterator, Tuple
 
 import click
 import cv2
-from moviepy.config import change_settings
+import numpy as np
 from moviepy.editor import (
     AudioFileClip,
-    CompositeVideoClip,
-    ImageClip,
     ImageSequenceClip,
     VideoClip,
     VideoFileClip,
@@ -17,10 +16,173 @@ from moviepy.editor import (
 )
 from moviepy.video import fx
 
-from constants import Resolution
-from utils import comparator_alphanum, mkdir
+from clip_cache import ClipCache, concat_clips
+from constants import (
+    AUDIO_CODEC,
+    AUDIO_FRAME_RATE,
+    BACKGROUND_BLUR_SIZE,
+    BACKGROUND_CLIP_FILENAME,
+    BACKGROUND_SCALE,
+    BODY_CLIP_FILENAME,
+    DELTA_FRAMES_FILENAME,
+    ENCODER_PROFILES,
+    FREEZE_LAST_FRAME_DURATION,
+    MAIN_CLIP_FILENAME,
+    SHADOW_MARGIN,
+    SNAPSHOT_EXTENSIONS,
+    VIDEO_CODEC,
+    VIDEO_FRAME_RATE,
+    Background,
+    Encoder,
+    Resolution,
+)
+from delta_frames import DeltaFrameReader, is_delta_file
+from utils import comparator_alphanum, mkdir, parallel_map
+from video_encoder import (
+    encode_frames,
+    get_frame_count,
+    get_frame_ranges,
+    get_output_params,
+    get_threads,
+    set_ffmpeg_binary,
+)
+
+
+class BackgroundBlur:
+    """
+    Blurs (background)frames and upsamples them to output_size.
+    * a frame the same as the previous one reuses its output. The sketcher
+      clips have runs of repeated frames(resampled to the frame rate) and
+      a frozen last frame
+    """
 
-change_settings({"FFMPEG_BINARY": "/usr/local/bin/ffmpeg"})
+    def __init__(self, kernel_size: int, output_size=None) -> None:
+        self.kernel_size = max(int(kernel_size), 1)
+        # (height, width)
+        self.output_size = output_size
+        self.last_image = None
+        self.last_output = None
+
+    def __call__(self, image: np.ndarray) -> np.ndarray:
+        # exact, a tolerance lets the blur drift from the frames
+        if self.last_image is not None and np.array_equal(
+            self.last_image, image
+        ):
+            return self.last_output
+        output = cv2.blur(image, (self.kernel_size, self.kernel_size))
+        if self.output_size is not None:
+            height, width = self.output_size
+            output = cv2.resize(
+                output, (width, height), interpolation=cv2.INTER_LINEAR
+            )
+        self.last_image, self.last_output = image, output
+        return output
+
+
+def get_scaled_size(image_size, height: int) -> Tuple[int, int]:
+    """(height, width) of an image scaled to height, keeping its aspect"""
+    h, w = image_size[:2]
+    return height, int(w * height / h)
+
+
+def resize(image: np.ndarray, image_size) -> np.ndarray:
+    """Resizes an image to (height, width), as moviepy's resize does"""
+    height, width = image_size
+    interpolation = (
+        cv2.INTER_LINEAR
+        if width > image.shape[1] or height > image.shape[0]
+        else cv2.INTER_AREA
+    )
+    return cv2.resize(image, (width, height), interpolation=interpolation)
+
+
+def get_rect_difference(rect, other) -> Iterator[Tuple[int, int, int, int]]:
+    """(x0, y0, x1, y1) rectangles covering rect but not other"""
+    x0, y0, x1, y1 = rect
+    ox0, oy0 = min(max(other[0], x0), x1), min(max(other[1], y0), y1)
+    ox1, oy1 = min(max(other[2], ox0), x1), min(max(other[3], oy0), y1)
+    rects = [
+        (x0, y0, x1, oy0),
+        (x0, oy1, x1, y1),
+        (x0, oy0, ox0, oy1),
+        (ox1, oy0, x1, oy1),
+    ]
+    return [(a, b, c, d) for a, b, c, d in rects if a < c and b < d]
+
+
+class FrameCompositor:
+    """
+    Composes a frame of the main clip from a (source)sketcher frame and
+    its blurred background, in a single pass.
+    * the foreground is scaled to the video height, on top of the shadow
+      (video height + shadow_margin), both centered at the top
+    * the shadow is scaled once, only the parts of it that are not
+      covered by the foreground are blended
+    """
+
+    def __init__(
+        self,
+        resolution,
+        frame_size,
+        shadow_image: np.ndarray = None,
+        shadow_margin: int = SHADOW_MARGIN,
+    ) -> None:
+        self.height, self.width = resolution
+        self.fg_size = get_scaled_size(frame_size, self.height)
+        self.fg_rect = self.get_rect(self.fg_size)
+        self.shadow = []
+        if shadow_image is not None:
+            self.shadow = self.get_shadow(shadow_image, shadow_margin)
+
+    def get_rect(self, image_size, box=None) -> Tuple[int, int, int, int]:
+        """
+        (x0, y0, x1, y1) of an image centered at the top of the box
+        (x0, y0, x1, y1), the video frame by default
+        """
+        x0, y0, x1, _ = box or (0, 0, self.width, self.height)
+        height, width = image_size
+        x = x0 + int((x1 - x0 - width) / 2)
+        return x, y0, x + width, y0 + height
+
+    def get_shadow(self, shadow_image: np.ndarray, margin: int):
+        """(rect, colors * alpha, 255 - alpha) of the visible shadow parts"""
+        shadow_size = get_scaled_size(shadow_image.shape, self.height + margin)
+        shadow_image = resize(shadow_image, shadow_size)
+        shadow_rect = self.get_rect(shadow_size)
+        # the foreground is centered in the shadow, as in a composite clip
+        self.fg_rect = self.get_rect(self.fg_size, box=shadow_rect)
+        if shadow_image.shape[2] == 4:
+            alpha = shadow_image[:, :, 3:].astype(np.uint16)
+        else:
+            alpha = np.full((*shadow_size, 1), 255, np.uint16)
+        colors = shadow_image[:, :, :3].astype(np.uint16) * alpha
+        x, y = shadow_rect[:2]
+        frame_rect = (0, 0, self.width, self.height)
+        visible = []
+        for x0, y0, x1, y1 in get_rect_difference(frame_rect, self.fg_rect):
+            x0, y0 = max(x0, shadow_rect[0]), max(y0, shadow_rect[1])
+            x1, y1 = min(x1, shadow_rect[2]), min(y1, shadow_rect[3])
+            if x0 >= x1 or y0 >= y1:
+                continue
+            part = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+            visible.append(((x0, y0, x1, y1), colors[part], 255 - alpha[part]))
+        return visible
+
+    def __call__(
+        self, frame: np.ndarray, background: np.ndarray
+    ) -> np.ndarray:
+        image = background.copy()
+        for (x0, y0, x1, y1), colors, keep in self.shadow:
+            region = image[y0:y1, x0:x1]
+            region[...] = (region * keep + colors + 127) // 255
+        x0, y0, x1, y1 = self.fg_rect
+        fg = resize(frame[:, :, :3], self.fg_size)
+        # the parts of the foreground outside the frame are cropped
+        fx0, fy0 = max(-x0, 0), max(-y0, 0)
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        image[y0:y1, x0:x1] = fg[fy0 : fy0 + y1 - y0, fx0 : fx0 + x1 - x0]
+        return image
 
 
 class MovieMaker:
@@ -34,8 +196,14 @@ class MovieMaker:
         bg_audio_file_path: str = None,
         duration: int = None,
         shadow_image_path: str = None,
-        frame_rate: int = 10,
+        frame_rate: int = VIDEO_FRAME_RATE,
         freeze_last_frame: bool = True,
+        background: str = Background.FAST,
+        main_clip: bool = False,
+        profile: str = Encoder.FINAL,
+        workers: int = 1,
+        threads: int = 0,
+        preview: bool = False,
     ) -> None:
         self.source_dir = source_dir
         self.bg_audio_file_path = bg_audio_file_path
@@ -46,8 +214,22 @@ class MovieMaker:
         self.intro_file_path = intro_file_path
         self.outro_file_path = outro_file_path
         self.resolution = Resolution.YOUTUBE_HD
+        if preview:
+            # the same pipeline at a low resolution, encoded fast
+            self.resolution = Resolution.PREVIEW
+            profile = Encoder.PREVIEW
         self.shadow_image_path = shadow_image_path
         self.freeze_last_frame = freeze_last_frame
+        self.background = background
+        self.main_clip = main_clip
+        self.profile = profile
+        self.workers = workers
+        self.threads = threads
+        self.clip_cache = ClipCache(
+            resolution=self.resolution,
+            frame_rate=self.frame_rate,
+            profile=profile,
+        )
         self.setup()
 
     def setup(self):
@@ -61,14 +243,43 @@ class MovieMaker:
     def width(self):
         return self.resolution[1]
 
+    @property
+    def scale(self) -> float:
+        """Scale of the video resolution, to the sizes set for HD"""
+        return self.height / Resolution.YOUTUBE_HD[0]
+
+    def get_deltaclip(self, file_path: str) -> VideoClip:
+        """Clip of the frames in a delta frames file"""
+        reader = DeltaFrameReader(file_path)
+        print(f"Found ->{len(reader)} delta frames in {file_path}")
+
+        def make_frame(t):
+            frame_index = int(round(t * self.frame_rate))
+            # BGR -> RGB
+            return reader.get_frame(frame_index)[:, :, ::-1]
+
+        duration = len(reader) / self.frame_rate
+        if self.freeze_last_frame:
+            duration += FREEZE_LAST_FRAME_DURATION
+        return VideoClip(make_frame=make_frame, duration=duration).set_fps(
+            self.frame_rate
+        )
+
     def get_imageclip(self, source_dir: str = None) -> VideoClip:
         source_dir = os.path.realpath(source_dir)
+        delta_file_path = (
+            source_dir
+            if os.path.isfile(source_dir)
+            else os.path.join(source_dir, DELTA_FRAMES_FILENAME)
+        )
+        if is_delta_file(delta_file_path):
+            return self.get_deltaclip(file_path=delta_file_path)
         os.chdir(source_dir)
         image_files = sorted(
             [
                 os.path.join(source_dir, img)
                 for img in os.listdir(source_dir)
-                if img.endswith(".png")
+                if img.endswith(SNAPSHOT_EXTENSIONS)
             ],
             key=comparator_alphanum,
         )
@@ -79,7 +290,7 @@ class MovieMaker:
         image_clip = ImageSequenceClip(image_files, self.frame_rate)
         if self.freeze_last_frame:
             image_clip_freeze = ImageSequenceClip(
-                image_files[-1:], durations=[5]
+                image_files[-1:], durations=[FREEZE_LAST_FRAME_DURATION]
             )
             image_clip = concatenate_videoclips(
                 [image_clip, image_clip_freeze]
@@ -87,27 +298,153 @@ class MovieMaker:
         return image_clip
 
     def blur(self, image):
-        return cv2.blur(image, (50, 50))
+        kernel_size = max(round(BACKGROUND_BLUR_SIZE * self.scale), 1)
+        return cv2.blur(image, (kernel_size, kernel_size))
 
-    def process_fg_video_clip(self, clip_path: str) -> VideoClip:
-        print("Processing FG video")
-        video_clip = VideoFileClip(filename=clip_path)
-        video_clip = self.add_shadow(
-            video_clip=video_clip, shadow_image_path=self.shadow_image_path
+    def upsample(self, image):
+        """Resizes a (reduced resolution)frame to the video resolution"""
+        return cv2.resize(
+            image, (self.width, self.height), interpolation=cv2.INTER_LINEAR
         )
-        return video_clip
 
-    def process_bg_video_clip(self, clip_path: str) -> VideoClip:
-        print("Processing bg video")
-        video_clip = VideoFileClip(
-            filename=clip_path, target_resolution=self.resolution
+    def downsample(self, image):
+        """Resizes a frame to 1/BACKGROUND_SCALE of the video resolution"""
+        return cv2.resize(
+            image,
+            (
+                max(self.width // BACKGROUND_SCALE, 2),
+                max(self.height // BACKGROUND_SCALE, 2),
+            ),
+            interpolation=cv2.INTER_AREA,
         )
-        video_clip = video_clip.fl_image(self.blur)
-        return video_clip
+
+    def has_source_frames(self) -> bool:
+        """Whether the source has snapshots(or delta frames)"""
+        source_path = os.path.realpath(self.source_dir)
+        if os.path.isfile(source_path):
+            return True
+        return os.path.isdir(source_path) and any(
+            file_name.endswith(SNAPSHOT_EXTENSIONS)
+            or file_name == DELTA_FRAMES_FILENAME
+            for file_name in os.listdir(source_path)
+        )
+
+    def get_source_clip(self) -> Tuple[VideoClip, str]:
+        """
+        The sketcher frames(snapshots or delta frames) + their path, or
+        main.mp4 saved from them once, with main_clip.
+        * without source frames, the main.mp4 of a 'stream' render is used
+        """
+        has_source_frames = self.has_source_frames()
+        if not has_source_frames and not os.path.exists(
+            os.path.join(self.target_dir, MAIN_CLIP_FILENAME)
+        ):
+            raise ValueError(
+                f"No snapshots(or delta frames) in {self.source_dir}, nor a"
+                f" {MAIN_CLIP_FILENAME} in {self.target_dir}"
+            )
+        if self.main_clip or not has_source_frames:
+            main_clip_path = self.process_image_clip(
+                source_dir=self.source_dir
+            )
+            return VideoFileClip(filename=main_clip_path), main_clip_path
+        source_path = os.path.realpath(self.source_dir)
+        return self.get_imageclip(source_dir=source_path), source_path
+
+    def process_bg_video_clip(
+        self, video_clip: VideoClip, source_path: str
+    ) -> VideoClip:
+        print(f"Processing bg video ({self.background})")
+        if self.background == Background.FULL:
+            return video_clip.fl_image(
+                lambda image: self.blur(resize(image, self.resolution))
+            )
+        if self.background == Background.PRECOMPUTED:
+            bg_clip = VideoFileClip(
+                filename=self.process_bg_clip_file(
+                    video_clip=video_clip, source_path=source_path
+                ),
+                audio=False,
+            )
+            return bg_clip.fl_image(self.upsample)
+        return self.get_fast_bg_video_clip(
+            video_clip=video_clip, output_size=self.resolution
+        )
+
+    def get_fast_bg_video_clip(
+        self, video_clip: VideoClip, output_size=None
+    ) -> VideoClip:
+        """
+        Background blurred at 1/BACKGROUND_SCALE of the video resolution,
+        upsampled to output_size(if any)
+        """
+        kernel_size = BACKGROUND_BLUR_SIZE * self.scale / BACKGROUND_SCALE
+        return video_clip.fl_image(self.downsample).fl_image(
+            BackgroundBlur(
+                kernel_size=kernel_size,
+                output_size=output_size,
+            )
+        )
+
+    def process_bg_clip_file(
+        self, video_clip: VideoClip, source_path: str
+    ) -> str:
+        """
+        Saves the (reduced resolution)blurred background once, it is
+        reused until the source frames change
+        """
+        file_path = os.path.join(self.target_dir, BACKGROUND_CLIP_FILENAME)
+        if os.path.exists(file_path) and os.path.getmtime(
+            file_path
+        ) >= os.path.getmtime(source_path):
+            print(f"Background Clip exists. {file_path}")
+            return file_path
+        bg_clip = self.get_fast_bg_video_clip(video_clip=video_clip)
+        return self.save_videoclip(
+            bg_clip, target_file_name=BACKGROUND_CLIP_FILENAME, audio=False
+        )
+
+    def compose_main_clip(
+        self, video_clip: VideoClip, source_path: str
+    ) -> VideoClip:
+        """
+        Main clip composed frame by frame from the source frames, the
+        background is derived from the same(cached) source frame
+        """
+        print("Composing BG and FG video")
+        bg_clip = self.process_bg_video_clip(
+            video_clip=video_clip, source_path=source_path
+        )
+        shadow_image = None
+        if self.shadow_image_path:
+            shadow_image = cv2.imread(
+                self.shadow_image_path, cv2.IMREAD_UNCHANGED
+            )
+            if shadow_image is None:
+                raise ValueError(
+                    f"Can not read shadow image {self.shadow_image_path}"
+                )
+            if shadow_image.ndim == 2:
+                shadow_image = cv2.cvtColor(shadow_image, cv2.COLOR_GRAY2BGR)
+            # BGR(A) -> RGB(A)
+            shadow_image[:, :, :3] = shadow_image[:, :, 2::-1]
+        compositor = FrameCompositor(
+            resolution=self.resolution,
+            frame_size=video_clip.size[::-1],
+            shadow_image=shadow_image,
+            shadow_margin=round(SHADOW_MARGIN * self.scale),
+        )
+
+        def make_frame(t):
+            return compositor(video_clip.get_frame(t), bg_clip.get_frame(t))
+
+        return VideoClip(
+            make_frame=make_frame, duration=video_clip.duration
+        ).set_fps(self.frame_rate)
 
     def process_image_clip(self, source_dir: str) -> Iterator[str]:
         print(f"Processing images to video")
-        file_name = "main.mp4"
+        file_name = MAIN_CLIP_FILENAME
         target_file_path = os.path.join(self.target_dir, file_name)
         if os.path.exists(target_file_path):
             print(f"Image Clip exists. {target_file_path}")
@@ -151,7 +488,11 @@ class MovieMaker:
             f"Speed factor is {speed_factor}. {audio_clip.duration} /"
             f" {video_clip.duration}"
         )
-        video_clip = video_clip.fx(vfx.speedx, speed_factor)
+        # clips rendered to the audio's duration(sketcher --duration) are
+        # not resampled
+        frame_duration = 1 / self.frame_rate
+        if abs(video_clip.duration - audio_clip.duration) >= frame_duration:
+            video_clip = video_clip.fx(vfx.speedx, speed_factor)
         video_clip = video_clip.set_audio(audio_clip)
         video_clip = video_clip.audio_fadeout(
             kwargs.get("audio_fadeout_duration", 2)
@@ -162,46 +503,15 @@ class MovieMaker:
         print("Adding audio complete")
         return video_clip
 
-    def add_shadow(
-        self, video_clip: VideoClip, shadow_image_path: str
-    ) -> VideoClip:
-        print("Adding shadow to video")
-        video_clip = video_clip.resize(height=self.height)
-        video_clip = video_clip.set_position(("center", "top"))
-        shadow_bg_image = ImageClip(shadow_image_path).set_duration(
-            video_clip.duration
-        )
-        shadow_bg_image = shadow_bg_image.resize(height=self.height + 20)
-        video_clip = CompositeVideoClip(
-            [shadow_bg_image, video_clip]
-        ).set_position(("center", "top"))
-        return video_clip
-
     def process_freeze_video(self, freeze_frame_path):
         return ImageSequenceClip([freeze_frame_path], durations=[5])
 
-    def process(self) -> None:
-        main_clip_path = self.process_image_clip(source_dir=self.source_dir)
-
-        intro_videoclip = VideoFileClip(
-            filename=self.intro_file_path,
-            target_resolution=Resolution.YOUTUBE_HD,
-        )
-        outro_videoclip = VideoFileClip(
-            filename=self.outro_file_path,
-            target_resolution=Resolution.YOUTUBE_HD,
-        )
-
-        main_videoclip_fg = self.process_fg_video_clip(
-            clip_path=main_clip_path
-        )
+    def get_main_video_clip(self) -> VideoClip:
+        """The main section of the video, with its audio"""
+        source_clip, source_path = self.get_source_clip()
 
-        main_videoclip_bg = self.process_bg_video_clip(
-            clip_path=main_clip_path
-        )
-        print("Composing BG and FG video")
-        main_video_clip = CompositeVideoClip(
-            [main_videoclip_bg, main_videoclip_fg]
+        main_video_clip = self.compose_main_clip(
+            video_clip=source_clip, source_path=source_path
         )
 
         main_video_clip = self.process_vfx(video_clip=main_video_clip)
@@ -209,27 +519,126 @@ class MovieMaker:
         main_video_clip = self.process_audio(
             video_clip=main_video_clip, audio_path=self.bg_audio_file_path
         )
+        return main_video_clip
 
-        final_video_clip = concatenate_videoclips(
-            [intro_videoclip, main_video_clip, outro_videoclip]
+    def process(self) -> None:
+        main_video_clip = self.get_main_video_clip()
+        body_clip_path = self.save_body_clip(video_clip=main_video_clip)
+        self.process_intro_outro(body_clip_path=body_clip_path)
+
+    def save_body_clip(self, video_clip: VideoClip) -> str:
+        """
+        Encodes the main section in 'workers' time chunks, each in its own
+        process, joined and muxed with the audio(encoded once)
+        """
+        target_file_path = os.path.join(self.target_dir, BODY_CLIP_FILENAME)
+        stem = os.path.splitext(target_file_path)[0]
+        frame_ranges = get_frame_ranges(
+            get_frame_count(video_clip.duration, self.frame_rate),
+            self.workers,
+        )
+        jobs = [
+            (frame_range, f"{stem}_{i}.mp4")
+            for i, frame_range in enumerate(frame_ranges)
+        ]
+        threads = get_threads(workers=len(jobs), threads=self.threads)
+        print(
+            f"Encoding main section({self.profile}) in {len(jobs)} chunk(s),"
+            f" {threads} thread(s) each"
+        )
+        if len(jobs) == 1:
+            frame_range, file_path = jobs[0]
+            chunk_file_paths = [
+                encode_frames(
+                    video_clip,
+                    frame_range=frame_range,
+                    file_path=file_path,
+                    frame_rate=self.frame_rate,
+                    profile=self.profile,
+                    threads=threads,
+                )
+            ]
+        else:
+            chunk_file_paths = list(
+                parallel_map(
+                    partial(
+                        encode_body_chunk, movie_maker=self, threads=threads
+                    ),
+                    jobs,
+                    workers=len(jobs),
+                )
+            )
+        audio_file_path = None
+        if video_clip.audio is not None:
+            audio_file_path = f"{stem}.m4a"
+            video_clip.audio.write_audiofile(
+                audio_file_path, fps=AUDIO_FRAME_RATE, codec=AUDIO_CODEC
+            )
+        concat_clips(
+            chunk_file_paths,
+            target_file_path,
+            audio_file_path=audio_file_path,
         )
+        for file_path in chunk_file_paths + [audio_file_path]:
+            if file_path:
+                os.remove(file_path)
+        return target_file_path
 
-        self.save_videoclip(video_clip=final_video_clip)
+    def process_intro_outro(self, body_clip_path: str) -> str:
+        """
+        Joins the (normalized, cached)intro and outro to the main section,
+        without re-encoding
+        """
+        file_paths = [body_clip_path]
+        if self.intro_file_path:
+            file_paths.insert(0, self.clip_cache.get(self.intro_file_path))
+        if self.outro_file_path:
+            file_paths.append(self.clip_cache.get(self.outro_file_path))
+        target_file_path = os.path.join(self.target_dir, self.target_file_name)
+        print(f"Joining intro and outro to {target_file_path}")
+        concat_clips(file_paths, target_file_path)
+        os.remove(body_clip_path)
+        return target_file_path
 
     def save_videoclip(
         self,
         video_clip: VideoClip,
         target_dir: str = None,
         target_file_name: str = None,
+        audio: bool = True,
     ):
         target_file_name = target_file_name or self.target_file_name
         target_dir = target_dir or self.target_dir
         target_file_path = os.path.join(target_dir, target_file_name)
         print(f"Saving video to {target_file_path}")
-        video_clip.write_videofile(target_file_path, fps=self.frame_rate)
+        video_clip.write_videofile(
+            target_file_path,
+            fps=self.frame_rate,
+            codec=VIDEO_CODEC,
+            preset=ENCODER_PROFILES[self.profile]["preset"],
+            audio=audio,
+            audio_codec=AUDIO_CODEC,
+            audio_fps=AUDIO_FRAME_RATE,
+            ffmpeg_params=get_output_params(
+                profile=self.profile, threads=self.threads, preset=False
+            ),
+        )
         return target_file_path
 
 
+def encode_body_chunk(job, movie_maker: MovieMaker, threads: int = 0) -> str:
+    """Encodes a chunk of the main section, in a worker process"""
+    frame_range, file_path = job
+    return encode_frames(
+        movie_maker.get_main_video_clip(),
+        frame_range=frame_range,
+        file_path=file_path,
+        frame_rate=movie_maker.frame_rate,
+        profile=movie_maker.profile,
+        threads=threads,
+    )
+
+
 @click.command()
 @click.option(
     "--intro-path",
@@ -259,7 +668,10 @@ class MovieMaker:
     "--source",
     required=True,
     type=str,
-    help="Directory with incrementally rendered images.",
+    help=(
+        "Directory with incrementally rendered images(or a delta frames"
+        " file)."
+    ),
 )
 @click.option(
     "--target",
@@ -274,6 +686,82 @@ class MovieMaker:
     default="result.mp4",
     help="Name of the final rendered video.",
 )
+@click.option(
+    "--background",
+    required=False,
+    type=click.Choice(
+        (Background.FAST, Background.PRECOMPUTED, Background.FULL)
+    ),
+    default=Background.FAST,
+    help=(
+        "Blurred background. 'fast' blurs at a reduced resolution and"
+        " reuses the blur of unchanged frames, 'precomputed' also saves it"
+        " as its own clip once, 'full' blurs at the video resolution."
+    ),
+)
+@click.option(
+    "--main-clip/--no-main-clip",
+    default=False,
+    help=(
+        "Save the source frames as main.mp4 once(or reuse it) and compose"
+        " the video from it, instead of straight from the source frames."
+    ),
+)
+@click.option(
+    "--frame-rate",
+    required=False,
+    type=click.IntRange(min=1),
+    default=VIDEO_FRAME_RATE,
+    help=(
+        "Frame rate of the video, the '--frame-rate' the source frames were"
+        " rendered at."
+    ),
+)
+@click.option(
+    "--profile",
+    required=False,
+    type=click.Choice((Encoder.PREVIEW, Encoder.FINAL)),
+    default=Encoder.FINAL,
+    help=(
+        "Encoder profile, 'preview' encodes fast at a lower quality,"
+        " 'final' at the quality to publish."
+    ),
+)
+@click.option(
+    "--workers",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1,
+    help=(
+        "Processes encoding the main section, in as many time chunks that"
+        " are joined after."
+    ),
+)
+@click.option(
+    "--threads",
+    required=False,
+    type=click.IntRange(min=0),
+    default=0,
+    help="Encoder threads per process, 0 shares the cores by the workers.",
+)
+@click.option(
+    "--ffmpeg-binary",
+    required=False,
+    type=str,
+    envvar="FFMPEG_BINARY",
+    default=None,
+    help="Path to ffmpeg, the one bundled with imageio by default.",
+)
+@click.option(
+    "--preview",
+    required=False,
+    is_flag=True,
+    default=False,
+    help=(
+        "Renders the video at a low resolution with the 'preview' encoder"
+        " profile, to review a render fast."
+    ),
+)
 def run(
     intro_path,
     outro_path,
@@ -282,10 +770,20 @@ def run(
     source,
     target,
     target_name,
+    background,
+    main_clip,
+    frame_rate,
+    profile,
+    workers,
+    threads,
+    ffmpeg_binary,
+    preview,
 ):
     """
     Movie Maker generates a video file.
     """
+    if ffmpeg_binary:
+        set_ffmpeg_binary(ffmpeg_binary)
     MovieMaker(
         intro_file_path=intro_path,
         outro_file_path=outro_path,
@@ -294,6 +792,13 @@ def run(
         source_dir=source,
         target_dir=target,
         target_file_name=target_name,
+        background=background,
+        main_clip=main_clip,
+        frame_rate=frame_rate,
+        profile=profile,
+        workers=workers,
+        threads=threads,
+        preview=preview,
     ).process()
     # mm = MovieMaker(
     #     intro_file_path="/Users/akashpatki/Documents/kash/python/auto_draw/.data/assets/intro.mp4",
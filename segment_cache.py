@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+from typing import Optional
+
+import numpy as np
+
+from constants import SEGMENT_CACHE_MAX_BYTES, SEGMENT_CACHE_PATH
+from utils import mkdir
+
+
+class SegmentCache:
+    """
+    Content addressed cache of base segment files.
+    * keyed on the hash of the preprocessed(binary) image and the
+      segmentation parameters, so identical images are segmented once
+      regardless of their name
+    * bounded to max_bytes, least recently used files are evicted first
+    """
+
+    def __init__(
+        self, cache_dir: str = None, max_bytes: int = SEGMENT_CACHE_MAX_BYTES
+    ) -> None:
+        self.cache_dir = cache_dir or SEGMENT_CACHE_PATH
+        self.max_bytes = max_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get_key(self, image: np.ndarray, **params) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str((image.shape, image.dtype.str)).encode())
+        digest.update(repr(sorted(params.items())).encode())
+        digest.update(np.ascontiguousarray(image).data)
+        return digest.hexdigest()
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.seg")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached segment file(if any), marked as recently used"""
+        file_path = self.get_path(key)
+        if not self.enabled or not os.path.exists(file_path):
+            return None
+        os.utime(file_path)
+        print(f"Segment cache hit -> {file_path}")
+        return file_path
+
+    def put(self, key: str, file_path: str) -> Optional[str]:
+        """Adds a segment file to the cache and evicts the stale ones"""
+        if not self.enabled:
+            return None
+        mkdir(self.cache_dir)
+        cache_file_path = self.get_path(key)
+        temp_file_path = f"{cache_file_path}.{os.getpid()}.tmp"
+        link_or_copy(file_path, temp_file_path)
+        # atomic, concurrent workers may add the same key
+        os.replace(temp_file_path, cache_file_path)
+        self.evict()
+        return cache_file_path
+
+    def fetch(self, key: str, target_file_path: str) -> bool:
+        """Places the cached segment file(if any) at target_file_path"""
+        cache_file_path = self.get(key)
+        if cache_file_path is None:
+            return False
+        link_or_copy(cache_file_path, target_file_path)
+        return True
+
+    def evict(self):
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(".seg"):
+                continue
+            stat = os.stat(os.path.join(self.cache_dir, filename))
+            entries.append((stat.st_mtime, stat.st_size, filename))
+        total = sum(size for _, size, _ in entries)
+        for _, size, filename in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            print(f"Segment cache evict -> {filename}")
+            try:
+                os.remove(os.path.join(self.cache_dir, filename))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def link_or_copy(source: str, target: str):
+    """Hard links source as target, copies it across file systems"""
+    if os.path.exists(target):
+        os.remove(target)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
@@ -0,0 +1,124 @@
+"""
+Per segment statistics of an image, computed once(vectorized) from the
+label map and the segment co-ordinates, and persisted in the segment file.
+
+* area      - (segments,) pixel count
+* bbox      - (segments, 4) x0, y0, x1, y1 (inclusive)
+* centroid  - (segments, 2) mean x, y
+* perimeter - (segments,) pixel edges shared with other segments or the
+  image border
+* anchor    - (segments, 2) x, y of the first pixel in x major order
+* adjacency - (pairs, 2) neighbouring colorable segments(a < b), see
+  coloring.get_segment_adjacency
+"""
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+
+from coloring import get_segment_adjacency
+
+STAT_SECTIONS = (
+    "area",
+    "bbox",
+    "centroid",
+    "perimeter",
+    "anchor",
+    "adjacency",
+)
+
+
+class SegmentStats:
+    def __init__(
+        self,
+        area: np.ndarray,
+        bbox: np.ndarray,
+        centroid: np.ndarray,
+        perimeter: np.ndarray,
+        anchor: np.ndarray,
+        adjacency: np.ndarray,
+    ) -> None:
+        self.area = area
+        self.bbox = bbox
+        self.centroid = centroid
+        self.perimeter = perimeter
+        self.anchor = anchor
+        self.adjacency = adjacency
+
+    def __len__(self) -> int:
+        return len(self.area)
+
+    @property
+    def sections(self) -> Dict[str, np.ndarray]:
+        return {name: getattr(self, name) for name in STAT_SECTIONS}
+
+    @classmethod
+    def from_sections(self, sections: Dict[str, np.ndarray]) -> SegmentStats:
+        """Statistics of a segment file, None if it predates them"""
+        if not all(name in sections for name in STAT_SECTIONS):
+            return None
+        return SegmentStats(**{name: sections[name] for name in STAT_SECTIONS})
+
+
+def get_perimeter(label_map: np.ndarray, count: int) -> np.ndarray:
+    padded = np.pad(label_map, 1, constant_values=-1)
+    perimeter = np.zeros(count, np.int64)
+    for a, b in (
+        (padded[:, :-1], padded[:, 1:]),
+        (padded[:-1], padded[1:]),
+    ):
+        edges = a != b
+        for labels in (a[edges], b[edges]):
+            perimeter += np.bincount(labels[labels >= 0], minlength=count)
+    return perimeter
+
+
+def get_segment_stats(
+    label_map: np.ndarray,
+    offsets: np.ndarray,
+    xs: np.ndarray,
+    ys: np.ndarray,
+    colorable: np.ndarray,
+) -> SegmentStats:
+    """
+    Statistics of the segments, segment i owns xs/ys[offsets[i]:
+    offsets[i + 1]], starting with its first pixel in x major order
+    """
+    count = len(offsets) - 1
+    starts = np.asarray(offsets[:-1], np.int64)
+    area = np.diff(offsets).astype(np.int64)
+    if count == 0:
+        return SegmentStats(
+            area=area,
+            bbox=np.zeros((0, 4), np.int32),
+            centroid=np.zeros((0, 2), np.float32),
+            perimeter=np.zeros(0, np.int64),
+            anchor=np.zeros((0, 2), np.int32),
+            adjacency=np.zeros((0, 2), np.int32),
+        )
+    bbox = np.stack(
+        [
+            np.minimum.reduceat(xs, starts),
+            np.minimum.reduceat(ys, starts),
+            np.maximum.reduceat(xs, starts),
+            np.maximum.reduceat(ys, starts),
+        ],
+        axis=1,
+    ).astype(np.int32)
+    centroid = np.stack(
+        [
+            np.add.reduceat(xs.astype(np.int64), starts) / area,
+            np.add.reduceat(ys.astype(np.int64), starts) / area,
+        ],
+        axis=1,
+    ).astype(np.float32)
+    a, b = get_segment_adjacency(label_map=label_map, colorable=colorable)
+    return SegmentStats(
+        area=area,
+        bbox=bbox,
+        centroid=centroid,
+        perimeter=get_perimeter(label_map, count),
+        anchor=np.stack([xs[starts], ys[starts]], axis=1).astype(np.int32),
+        adjacency=np.stack([a, b], axis=1).astype(np.int32),
+    )
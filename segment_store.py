@@ -0,0 +1,191 @@
+"""
+Binary, memory mappable storage of an image's segments.
+
+Layout of a segment file
+* magic (8 bytes) | format version (uint32) | header length (uint32)
+* header - json with the image size and the section table
+* sections - raw little endian arrays, each aligned to SECTION_ALIGNMENT
+
+Sections
+* label_map   - (height, width) int32, segment index of every pixel
+* offsets     - (segments + 1) int64, segment i owns xs/ys[o[i]:o[i + 1]]
+* xs, ys      - (pixels) int32, co-ordinates of the segments
+* base_colors - (segments, 3) uint8
+* colors      - (segments, 3) uint8, only present for colored versions
+* area, bbox, centroid, perimeter, anchor, adjacency - the per segment
+  statistics(see segment_stats.py), since version 2
+"""
+import glob
+import json
+import os
+import pickle
+import struct
+from typing import Dict
+
+import click
+import numpy as np
+
+from constants import BIN_FOLDER_NAME, TARGET_PATH
+
+SEGMENT_FILE_MAGIC = b"AIDSEG\x00\x00"
+SEGMENT_FILE_VERSION = 2
+SECTION_ALIGNMENT = 64
+PREAMBLE = struct.Struct("<8sII")
+# classes pickled by running a script directly reference '__main__'
+LEGACY_CLASS_MODULES = {
+    "Point": "image",
+    "ImageSegment": "image",
+    "AutoImageDraw": "image_orchestrator",
+}
+
+
+def is_segment_file(file_path: str) -> bool:
+    with open(file_path, "rb") as fh:
+        return fh.read(len(SEGMENT_FILE_MAGIC)) == SEGMENT_FILE_MAGIC
+
+
+def align(offset: int) -> int:
+    return -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def write_segment_file(
+    file_path: str,
+    image_size,
+    sections: Dict[str, np.ndarray],
+    meta: dict = None,
+):
+    """
+    Writes the given arrays as sections of a segment file
+    """
+    table, offset = {}, 0
+    for name, array in sections.items():
+        array = np.ascontiguousarray(array)
+        sections[name] = array
+        table[name] = {
+            "dtype": array.dtype.newbyteorder("<").str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = align(offset + array.nbytes)
+    header = json.dumps(
+        {
+            "height": int(image_size[0]),
+            "width": int(image_size[1]),
+            "meta": meta or {},
+            "sections": table,
+        }
+    ).encode()
+    data_offset = align(PREAMBLE.size + len(header))
+    # written aside and moved in place, mapped(or linked) readers of the
+    # previous file keep their pages
+    temp_file_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_file_path, "wb") as fh:
+        fh.write(
+            PREAMBLE.pack(
+                SEGMENT_FILE_MAGIC, SEGMENT_FILE_VERSION, len(header)
+            )
+        )
+        fh.write(header)
+        for name, array in sections.items():
+            fh.seek(data_offset + table[name]["offset"])
+            fh.write(array.astype(table[name]["dtype"], copy=False).tobytes())
+        # pad the last section so that every section is fully mappable
+        fh.truncate(data_offset + offset)
+    os.replace(temp_file_path, file_path)
+    print(f"Saved binary to -> {file_path}")
+
+
+def read_segment_file(file_path: str) -> dict:
+    """
+    Memory maps a segment file. The sections are read-only views of the
+    mapped file, so processes loading the same file share the pages.
+    """
+    with open(file_path, "rb") as fh:
+        magic, version, header_length = PREAMBLE.unpack(fh.read(PREAMBLE.size))
+        if magic != SEGMENT_FILE_MAGIC:
+            raise ValueError(f"Not a segment file -> {file_path}")
+        if version > SEGMENT_FILE_VERSION:
+            raise ValueError(
+                f"Unsupported segment file version {version} -> {file_path}"
+            )
+        header = json.loads(fh.read(header_length))
+    data_offset = align(PREAMBLE.size + header_length)
+    buffer = np.memmap(file_path, dtype=np.uint8, mode="r")
+    sections = {}
+    for name, section in header["sections"].items():
+        dtype = np.dtype(section["dtype"])
+        start = data_offset + section["offset"]
+        count = int(np.prod(section["shape"], dtype=np.int64))
+        sections[name] = (
+            buffer[start : start + count * dtype.itemsize]
+            .view(dtype)
+            .reshape(section["shape"])
+        )
+    return {
+        "version": version,
+        "image_size": (header["height"], header["width"]),
+        "meta": header["meta"],
+        "sections": sections,
+    }
+
+
+class LegacyUnpickler(pickle.Unpickler):
+    """Unpickler for the (legacy) pkl files"""
+
+    def find_class(self, module, name):
+        if module == "__main__" and name in LEGACY_CLASS_MODULES:
+            module = LEGACY_CLASS_MODULES[name]
+        return super().find_class(module, name)
+
+
+def load_pickle(file_path: str):
+    with open(file_path, "rb") as fh:
+        return LegacyUnpickler(fh).load()
+
+
+def convert_pickle(file_path: str, overwrite: bool = False) -> str:
+    """
+    Converts a (legacy) pkl file to a segment file next to it
+    """
+    from image_orchestrator import AutoImageDraw
+
+    target_file_path = os.path.splitext(file_path)[0] + ".seg"
+    if os.path.exists(target_file_path) and not overwrite:
+        print(f"Segment file exists -> {target_file_path}")
+        return target_file_path
+    aid: AutoImageDraw = load_pickle(file_path)
+    AutoImageDraw.write(aid=aid, file_path=target_file_path)
+    return target_file_path
+
+
+@click.command()
+@click.option(
+    "--source",
+    required=False,
+    type=str,
+    default=os.path.join(TARGET_PATH, "*", BIN_FOLDER_NAME),
+    help="Directory(glob) with the pkl files to be converted.",
+)
+@click.option(
+    "--overwrite",
+    required=False,
+    is_flag=True,
+    default=False,
+    help="Overwrite the segment files that already exist.",
+)
+def run(source, overwrite):
+    """
+    Converts pkl files to the memory mappable segment files.
+    """
+    file_paths = sorted(glob.glob(os.path.join(source, "*.pkl")))
+    print(f"Found {len(file_paths)} pkl files in {source}")
+    for i, file_path in enumerate(file_paths):
+        print(f"Converting {i+1} of {len(file_paths)} -> {file_path}")
+        try:
+            convert_pickle(file_path=file_path, overwrite=overwrite)
+        except Exception as e:
+            print(f"Failed to convert {file_path}: {e}")
+
+
+if __name__ == "__main__":
+    run()
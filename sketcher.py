@@ -1,7 +1,7 @@
+import json
 import os
 from email.policy import default
 from pathlib import Path
-from time import time
 from typing import Iterator
 
 import click
@@ -9,26 +9,60 @@ import cv2
 import numpy as np
 
 from constants import (
+    CHECKPOINT_EXTENSION,
+    CHECKPOINT_INTERVAL,
     DEFAULT_SNAPSHOT_COUNTER,
+    DELTA_FRAMES_FILENAME,
     FRAME_RATE,
+    FREEZE_LAST_FRAME_DURATION,
     LARGE_SEGMENT_PIXEL_COUNT,
+    MAIN_CLIP_FILENAME,
+    PREVIEW_FRAME_FRACTION,
     SNAPSHOT_TIMES,
+    SNAPSHOT_WRITER_THREADS,
     SNAPSHOTS_FOLDER_NAME,
+    VIDEO_FOLDER_NAME,
+    VIDEO_FRAME_RATE,
     Render,
+    SnapshotFormat,
+)
+from delta_frames import DeltaFrameWriter
+from frame_writers import (
+    SnapshotWriter,
+    VideoStreamWriter,
+    get_imwrite_params,
 )
 from image import ImageSegment
 from image_orchestrator import AutoImageDraw
+from tile_painter import (
+    get_tile_groups,
+    plan_tiled_frames,
+    render_tiled_frames,
+)
 from utils import (
-    comparator_closest_segment,
-    comparator_img_seg_size,
     get_filename_from_path,
+    get_frame_budget,
+    get_frame_stops,
+    get_nearest_chain,
     mkdir,
 )
 
 
 class Sketcher:
     def __init__(
-        self, binary_filepath: str, snanpshot_times=None, mode: str = None
+        self,
+        binary_filepath: str,
+        snanpshot_times=None,
+        mode: str = None,
+        snapshot_format: str = SnapshotFormat.PNG,
+        png_compression: int = None,
+        writer_threads: int = SNAPSHOT_WRITER_THREADS,
+        duration: float = None,
+        video_frame_rate: int = VIDEO_FRAME_RATE,
+        tiles: int = 1,
+        workers: int = 1,
+        resume: bool = False,
+        frame_fraction: float = 1.0,
     ) -> None:
         self.aid = AutoImageDraw.load(binary_filepath)
         self.binary_filepath = binary_filepath
@@ -48,49 +82,346 @@ class Sketcher:
         self.delay = int(1000 / self.frame_rate)
         self.target_dir = None
         self.mode = mode or Render.ACTIVE
+        self.video_writer = None
+        self.snapshot_writer = None
+        self.delta_writer = None
+        # (ys, xs, color) painted since the last frame, for delta frames
+        self.painted = []
+        self.snapshot_format = snapshot_format
+        self.png_compression = png_compression
+        self.writer_threads = writer_threads
+        self.duration = duration
+        self.video_frame_rate = video_frame_rate
+        # frames of every segment(by id) when rendering to a duration
+        self.segment_frames = None
+        self.tiles = tiles
+        self.workers = workers
+        self.resume = resume
+        # fraction of the frames rendered(previews), through the budget
+        self.frame_fraction = frame_fraction
+        # phase(paint_segments call) being painted and its frames so far
+        self.phase = -1
+        self.phase_frames = 0
+        # frames of the phase already painted(per the checkpoint)
+        self.skip_frames = 0
+        self.checkpoint = None
         self.setup()
 
     def setup(self):
-        target_dir = os.path.join(
-            Path(self.binary_filepath).parents[1], SNAPSHOTS_FOLDER_NAME
-        )
-        mkdir(target_dir)
+        if self.workers > 1 and self.mode != Render.OFFLINE:
+            raise ValueError(
+                f"Frames are rendered by workers in '{Render.OFFLINE}' mode"
+                f" only, not '{self.mode}'"
+            )
+        if self.resume and self.mode == Render.STREAM:
+            raise ValueError(f"'{Render.STREAM}' renders can not be resumed")
+        if self.mode == Render.STREAM:
+            target_dir = os.path.join(
+                Path(self.binary_filepath).parents[1], VIDEO_FOLDER_NAME
+            )
+            mkdir(target_dir)
+            self.video_writer = VideoStreamWriter(
+                file_path=os.path.join(target_dir, MAIN_CLIP_FILENAME),
+                image_size=(self.aid.image_height, self.aid.image_width),
+                frame_rate=self.video_frame_rate,
+            )
+        else:
+            target_dir = os.path.join(
+                Path(self.binary_filepath).parents[1], SNAPSHOTS_FOLDER_NAME
+            )
+            mkdir(target_dir)
         self.target_dir = target_dir
+        if self.resume:
+            self.load_checkpoint()
+        if self.mode == Render.DELTA:
+            self.delta_writer = DeltaFrameWriter(
+                file_path=os.path.join(target_dir, DELTA_FRAMES_FILENAME),
+                image_size=(self.aid.image_height, self.aid.image_width),
+                frame_count=(self.checkpoint or {}).get("delta_frames", 0),
+            )
+        if self.mode == Render.OFFLINE:
+            self.snapshot_writer = SnapshotWriter(
+                target_dir=target_dir,
+                image_format=self.snapshot_format,
+                png_compression=self.png_compression,
+                threads=self.writer_threads,
+            )
 
     def paint(self):
-        self.paint_non_k_segments()
-        self.paint_k_segments()
+        self.plan_frame_budget()
+        complete = False
+        try:
+            self.paint_non_k_segments()
+            self.paint_k_segments()
+            complete = True
+        finally:
+            self.close(complete=complete)
+        self.remove_checkpoint()
+
+    @property
+    def checkpoint_path(self) -> str:
+        return os.path.join(
+            self.target_dir,
+            get_filename_from_path(self.binary_filepath, include_ext=False)
+            + CHECKPOINT_EXTENSION,
+        )
+
+    @property
+    def checkpoint_params(self) -> dict:
+        """Parameters that change the frames, a resume has to match them"""
+        return {
+            "binary_filepath": os.path.realpath(self.binary_filepath),
+            "mode": self.mode,
+            "snanpshot_times": [list(times) for times in self.snanpshot_times],
+            "duration": self.duration,
+            "video_frame_rate": self.video_frame_rate,
+            "tiles": self.tiles,
+            "frame_fraction": self.frame_fraction,
+        }
+
+    def save_checkpoint(self, phase: int, frames: int):
+        """
+        Saves the canvas, after 'frames' frames of the phase, once the
+        frames before it are written
+        """
+        if self.mode not in (Render.OFFLINE, Render.DELTA):
+            return
+        cursor = {"phase": phase, "frames": frames, **self.checkpoint_params}
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.flush()
+        if self.delta_writer is not None:
+            self.delta_writer.flush()
+            cursor["delta_frames"] = self.delta_writer.frame_count
+        temp_file_path = f"{self.checkpoint_path}.tmp"
+        with open(temp_file_path, "wb") as fh:
+            np.savez(fh, image=self.image, cursor=json.dumps(cursor))
+        # the previous checkpoint is kept until the new one is complete
+        os.replace(temp_file_path, self.checkpoint_path)
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            print(f"No checkpoint to resume from -> {self.checkpoint_path}")
+            return
+        with np.load(self.checkpoint_path) as checkpoint:
+            cursor = json.loads(str(checkpoint["cursor"]))
+            image = checkpoint["image"]
+        # checkpoints saved before previews had all the frames
+        cursor.setdefault("frame_fraction", 1.0)
+        params = {key: cursor.get(key) for key in self.checkpoint_params}
+        if params != self.checkpoint_params:
+            raise ValueError(
+                f"Checkpoint {self.checkpoint_path} was saved with other"
+                f" parameters {params}"
+            )
+        np.copyto(self.image, image)
+        self.checkpoint = cursor
+        print(
+            f"Resuming from phase {cursor['phase']}, frame"
+            f" {cursor['frames']} -> {self.checkpoint_path}"
+        )
+
+    def remove_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def close(self, complete: bool = True):
+        if self.video_writer is not None:
+            self.video_writer.close(complete=complete)
+            self.video_writer = None
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()
+            self.snapshot_writer = None
+        if self.delta_writer is not None:
+            self.delta_writer.close()
+            self.delta_writer = None
 
     def get_snapshot_counter(self, segment: ImageSegment) -> int:
         """Calculate image snapshot counter based on config"""
         for segment_pixel_count, snapshot_ctr in self.snanpshot_times:
-            if len(segment.points) <= segment_pixel_count:
+            if len(segment) <= segment_pixel_count:
                 return snapshot_ctr
         return self.snapshot_counter
 
     def get_file_name(self):
-        file_name = "_".join(
-            get_filename_from_path(
-                self.binary_filepath, include_ext=False
-            ).split("_")[:-1]
+        """Deterministic name(prefix) of the frames of the current phase"""
+        file_name = get_filename_from_path(
+            self.binary_filepath, include_ext=False
+        )
+        return f"{file_name}_{self.phase}"
+
+    def get_frame_count(self) -> int:
+        """
+        Frames needed for a main clip of duration seconds, including the
+        frozen last frame
+        """
+        frame_count = round(
+            (self.duration - FREEZE_LAST_FRAME_DURATION)
+            * self.video_frame_rate
         )
-        return f"{file_name}_{int(time()*1000)}"
+        if frame_count < 1:
+            raise ValueError(
+                f"Duration {self.duration}s is too short, the last frame is"
+                f" frozen for {FREEZE_LAST_FRAME_DURATION}s"
+            )
+        return frame_count
+
+    def plan_frame_budget(self):
+        """
+        Allocates the frames of the target duration(if any) across all the
+        segments, proportional to their size.
+        * with a frame fraction, only that fraction of the frames(of the
+          duration, or of the snapshot times) is allocated
+        """
+        if self.duration is None and self.frame_fraction >= 1:
+            return
+        image_segments = self.aid.image_segments
+        if self.duration is not None:
+            frame_count = self.get_frame_count()
+        else:
+            frame_count = sum(
+                len(stops) for stops in self.plan_segments(image_segments)
+            )
+        frame_count = max(round(frame_count * self.frame_fraction), 1)
+        frames = get_frame_budget(
+            [len(segment) for segment in image_segments], frame_count
+        )
+        self.segment_frames = {
+            id(segment): n
+            for segment, n in zip(image_segments, frames.tolist())
+        }
+        print(
+            f"Frame budget -> {int(frames.sum())} of {frame_count} frames"
+            f" (duration {self.duration}, {self.video_frame_rate} fps,"
+            f" fraction {self.frame_fraction:g})"
+        )
+
+    def plan_segment(self, image_segment: ImageSegment) -> np.ndarray:
+        """
+        Frame schedule of a segment, the (exclusive)pixel index after which
+        each snapshot is taken.
+        * with a frame budget, the segment's frames are spread evenly
+        * otherwise a snapshot is taken every snapshot counter pixels,
+          after the pixel j where j % snapshot counter == 1.
+        """
+        if self.segment_frames is not None:
+            return get_frame_stops(
+                len(image_segment), self.segment_frames[id(image_segment)]
+            )
+        snapshot_counter = self.get_snapshot_counter(image_segment)
+        if snapshot_counter <= 1:
+            # j % 1 is never 1
+            return np.zeros(0, np.int64)
+        return np.arange(2, len(image_segment) + 1, snapshot_counter)
+
+    def plan_segments(
+        self, image_segments: Iterator[ImageSegment]
+    ) -> Iterator[np.ndarray]:
+        return [self.plan_segment(segment) for segment in image_segments]
+
+    def paint_points(self, ys: np.ndarray, xs: np.ndarray, color):
+        if self.phase_frames < self.skip_frames:
+            # painted before the checkpoint
+            return
+        self.image[ys, xs] = color
+        if self.delta_writer is not None:
+            self.painted.append((ys, xs, color))
+
+    def paint_pixels(self, image_segment: ImageSegment, start: int, stop: int):
+        """Paints a range of the segment's pixels in one batch"""
+        self.paint_points(
+            ys=image_segment.ys[start:stop],
+            xs=image_segment.xs[start:stop],
+            color=image_segment.color,
+        )
+
+    def paint_tiled_segments(self, image_segments: Iterator[ImageSegment]):
+        """
+        Paints the segments of each tile concurrently, frames are named by
+        their index in the (merged)order
+        """
+        groups = get_tile_groups(
+            image_segments,
+            image_size=(self.aid.image_height, self.aid.image_width),
+            tiles=self.tiles,
+        )
+        ys, xs, colors, ends = plan_tiled_frames(groups, self.plan_segment)
+        print(
+            f"Painting {len(image_segments)} segments in {len(groups)}"
+            f" tiles -> {len(ends)} frames"
+        )
+        file_name = self.get_file_name()
+        start = 0
+        if self.workers > 1:
+            render_tiled_frames(
+                canvas=self.image,
+                order=(ys, xs, colors, ends),
+                file_name=file_name,
+                target_dir=self.target_dir,
+                workers=self.workers,
+                image_format=self.snapshot_format,
+                params=get_imwrite_params(
+                    self.snapshot_format, self.png_compression
+                ),
+            )
+            # the frames are rendered(or were, before the checkpoint)
+            self.phase_frames = len(ends)
+        else:
+            for k, stop in enumerate(ends.tolist()):
+                self.paint_points(
+                    ys[start:stop], xs[start:stop], colors[start:stop]
+                )
+                self.take_snapshot(file_name=f"{file_name}_{k}.png")
+                start = stop
+        self.paint_points(ys[start:], xs[start:], colors[start:])
+
+    def take_snapshot(self, file_name: str):
+        """Processes a frame, unless it was taken before the checkpoint"""
+        if self.phase_frames >= self.skip_frames:
+            self.process_image(file_name=file_name)
+        self.phase_frames += 1
+        if self.phase_frames % CHECKPOINT_INTERVAL == 0:
+            self.save_checkpoint(phase=self.phase, frames=self.phase_frames)
 
     def paint_segments(self, image_segments: Iterator[ImageSegment]):
-        for i, image_segment in enumerate(image_segments):
-            snapshot_counter = self.get_snapshot_counter(image_segment)
+        """
+        Paints a phase, phases completed before the checkpoint(if any) are
+        skipped and the current one resumes after its checkpointed frames
+        """
+        self.phase += 1
+        self.phase_frames = 0
+        self.skip_frames = 0
+        if self.checkpoint is not None:
+            if self.phase < self.checkpoint["phase"]:
+                return
+            if self.phase == self.checkpoint["phase"]:
+                self.skip_frames = self.checkpoint["frames"]
+        if image_segments:
+            if self.tiles > 1 or self.workers > 1:
+                self.paint_tiled_segments(image_segments)
+            else:
+                self.paint_sequential_segments(image_segments)
+        self.save_checkpoint(phase=self.phase + 1, frames=0)
+
+    def paint_sequential_segments(
+        self, image_segments: Iterator[ImageSegment]
+    ):
+        schedule = self.plan_segments(image_segments)
+        for i, (image_segment, stops) in enumerate(
+            zip(image_segments, schedule)
+        ):
             print(
-                f"Snapshot Counter for seg_id({i+1}/{len(image_segments)}) ->"
-                f" {snapshot_counter} -> {len(image_segment.points)}"
+                f"Frames for seg_id({i+1}/{len(image_segments)}) ->"
+                f" {len(stops)} -> {len(image_segment)}"
             )
-            count = 0
             file_name = self.get_file_name()
-            for j, point in enumerate(image_segment.points):
-                x, y = point.x, point.y
-                self.image[y, x] = image_segment.color
-                if count % snapshot_counter == 1:
-                    self.process_image(file_name=f"{file_name}_{i}_{j}.png")
-                count += 1
+            start = 0
+            for stop in stops.tolist():
+                self.paint_pixels(image_segment, start=start, stop=stop)
+                self.take_snapshot(file_name=f"{file_name}_{i}_{stop - 1}.png")
+                start = stop
+            self.paint_pixels(
+                image_segment, start=start, stop=len(image_segment)
+            )
 
     def show_image_snapshot(self, image: np.ndarray):
         cv2.imshow("default", image)
@@ -108,11 +439,12 @@ class Sketcher:
         if self.mode == Render.ACTIVE:
             self.show_image_snapshot(image=self.image)
         if self.mode == Render.OFFLINE:
-            self.save_image_snapshot(
-                image=self.image,
-                target_dir=self.target_dir,
-                file_name=file_name,
-            )
+            self.snapshot_writer.write(file_name=file_name, image=self.image)
+        if self.mode == Render.STREAM:
+            self.video_writer.write(image=self.image)
+        if self.mode == Render.DELTA:
+            self.delta_writer.write(image=self.image, deltas=self.painted)
+            self.painted = []
 
     def partition_segments(
         self, segments: Iterator[ImageSegment]
@@ -124,34 +456,26 @@ class Sketcher:
         * Non large partition sort is based on min distance
           btween the image segments
         """
-        temp_non_large_segments = []
-        large_segments = []
+        # sizes and anchors are read from the segment statistics
+        stats = self.aid.stats
+        indices = np.array([segment.index for segment in segments], np.int64)
+        areas = stats.area[indices]
         # Split the segments in to 2 categories based on pixel count
-        for segment in segments:
-            if len(segment.points) > LARGE_SEGMENT_PIXEL_COUNT:
-                large_segments.append(segment)
-            else:
-                temp_non_large_segments.append(segment)
+        large = np.flatnonzero(areas > LARGE_SEGMENT_PIXEL_COUNT)
+        non_large = np.flatnonzero(areas <= LARGE_SEGMENT_PIXEL_COUNT)
 
         # Sort the large segments
-        large_segments = sorted(
-            large_segments, reverse=False, key=comparator_img_seg_size
-        )
+        large_segments = [
+            segments[i]
+            for i in large[np.argsort(areas[large], kind="stable")].tolist()
+        ]
 
         # Sort the non large sements based on the image segment proximity
-        ctr = 0
-        total_non_large_segments = len(temp_non_large_segments)
-        non_large_segments = []
-        while ctr < total_non_large_segments:
-            ref_segment = temp_non_large_segments.pop(0)
-            non_large_segments.append(ref_segment)
-            temp_non_large_segments = sorted(
-                temp_non_large_segments,
-                key=lambda segment: comparator_closest_segment(
-                    segment, ref_segment
-                ),
-            )
-            ctr += 1
+        # i.e. a chain of the closest next segment(comparator_closest_segment)
+        anchors = stats.anchor[indices[non_large]].reshape(-1, 2)
+        non_large_segments = [
+            segments[non_large[i]] for i in get_nearest_chain(anchors)
+        ]
         return large_segments, non_large_segments
 
     def paint_k_segments(self):
@@ -186,7 +510,7 @@ class Sketcher:
             print(f"Painting {len(segments)} colored segments")
             self.paint_segments(segments)
             for segment in segments:
-                segment.sort_avg()
+                segment.sort_avg_arrays()
 
 
 @click.command()
@@ -194,23 +518,128 @@ class Sketcher:
     "--binary-file-path",
     required=True,
     type=str,
-    help="Path to the 'pkl' file, to be rendered.",
+    help="Path to the segment('seg' or legacy 'pkl') file, to be rendered.",
 )
 @click.option(
     "--mode",
     required=False,
-    type=click.Choice((Render.ACTIVE, Render.OFFLINE)),
+    type=click.Choice(
+        (Render.ACTIVE, Render.OFFLINE, Render.STREAM, Render.DELTA)
+    ),
     default=Render.ACTIVE,
     help=(
         "Rendering mode. 'active' renders the images in a window. 'offline'"
-        " generates incremental images of the render."
+        " generates incremental images of the render. 'stream' encodes the"
+        " render straight to the 'main.mp4' video used by movie_maker."
+        " 'delta' saves keyframes and the painted pixels of every frame in"
+        " a single file."
+    ),
+)
+@click.option(
+    "--snapshot-format",
+    required=False,
+    type=click.Choice(
+        (SnapshotFormat.PNG, SnapshotFormat.BMP, SnapshotFormat.JPG)
+    ),
+    default=SnapshotFormat.PNG,
+    help="Image format of the 'offline' snapshots.",
+)
+@click.option(
+    "--png-compression",
+    required=False,
+    type=click.IntRange(min=0, max=9),
+    default=None,
+    help="PNG compression level, lower is faster(and larger).",
+)
+@click.option(
+    "--writer-threads",
+    required=False,
+    type=click.IntRange(min=1),
+    default=SNAPSHOT_WRITER_THREADS,
+    help="Background threads saving the 'offline' snapshots.",
+)
+@click.option(
+    "--duration",
+    required=False,
+    type=click.FloatRange(min=0, min_open=True),
+    default=None,
+    help=(
+        "Duration(seconds) of the main clip(e.g. the background music),"
+        " including the frozen last frame. The frames are allocated across"
+        " the segments to fit it exactly."
+    ),
+)
+@click.option(
+    "--frame-rate",
+    required=False,
+    type=click.IntRange(min=1),
+    default=VIDEO_FRAME_RATE,
+    help="Frame rate of the main clip, used with '--duration'.",
+)
+@click.option(
+    "--tiles",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1,
+    help=(
+        "Paints the segments of (tiles x tiles)image tiles side by side,"
+        " all the tiles advance together. 1 paints the segments one after"
+        " another."
     ),
 )
-def run(binary_file_path, mode):
+@click.option(
+    "--workers",
+    required=False,
+    type=click.IntRange(min=1),
+    default=1,
+    help=(
+        "Processes rendering(saving) contiguous ranges of the 'offline'"
+        " snapshots."
+    ),
+)
+@click.option(
+    "--preview",
+    required=False,
+    is_flag=True,
+    default=False,
+    help=(
+        f"Renders {PREVIEW_FRAME_FRACTION:.0%} of the frames, spread across"
+        " the segments as with '--duration', to review a render fast."
+    ),
+)
+@click.option(
+    "--resume",
+    required=False,
+    is_flag=True,
+    default=False,
+    help="Continues an interrupted render from its last checkpoint.",
+)
+def run(
+    binary_file_path,
+    mode,
+    snapshot_format,
+    png_compression,
+    writer_threads,
+    duration,
+    frame_rate,
+    tiles,
+    workers,
+    resume,
+    preview,
+):
     sketcher = Sketcher(
         binary_filepath=binary_file_path,
         snanpshot_times=None,
         mode=mode,
+        snapshot_format=snapshot_format,
+        png_compression=png_compression,
+        writer_threads=writer_threads,
+        duration=duration,
+        video_frame_rate=frame_rate,
+        tiles=tiles,
+        workers=workers,
+        resume=resume,
+        frame_fraction=PREVIEW_FRAME_FRACTION if preview else 1.0,
     )
     sketcher.paint()
 
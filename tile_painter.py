@@ -0,0 +1,228 @@
+"""
+Painting of segment groups(image tiles) side by side, and rendering of
+their frames by concurrent processes.
+
+The segments of a phase are grouped by the tile of their anchor, groups
+do not share pixels. The frames of the groups are interleaved into a
+single(deterministic) pixel order, each group advances proportionally so
+that all the groups are painted together. Frame k is the canvas at the
+start of the phase with the first ends[k] pixels of the order painted.
+
+The tiles set the order, the concurrency is over frames: contiguous
+ranges of frames are rendered by a pool of processes, sharing the canvas
+and the order in shared memory. Each process keeps its own canvas and
+paints on from its previous range, so every pixel is painted once per
+process, and saving(encoding) the frames scales with the processes.
+"""
+import os
+from functools import partial
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterator, Tuple
+
+import cv2
+import numpy as np
+
+from image import ImageSegment
+from utils import parallel_map
+
+# frame ranges per worker, smaller ranges balance the load better
+FRAME_RANGES_PER_WORKER = 4
+
+# canvas of the (worker)process with the count of the order painted on it,
+# by the name of the shared canvas of the phase
+WORKER_CANVASES = {}
+
+
+def get_tile_groups(
+    segments: Iterator[ImageSegment], image_size, tiles: int
+) -> Iterator[Iterator[ImageSegment]]:
+    """
+    Groups the segments by the (tiles x tiles)tile of their anchor, the
+    order of the segments is kept within a group
+    """
+    height, width = image_size
+    groups = {}
+    for segment in segments:
+        anchor = segment.anchor
+        tile = (
+            min(anchor.y * tiles // height, tiles - 1),
+            min(anchor.x * tiles // width, tiles - 1),
+        )
+        groups.setdefault(tile, []).append(segment)
+    return [groups[tile] for tile in sorted(groups)]
+
+
+def plan_tiled_frames(
+    groups: Iterator[Iterator[ImageSegment]],
+    plan_segment: Callable[[ImageSegment], np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Merges the frame schedules of the groups, returns the pixel order
+    (ys, xs, colors) and the count of painted pixels at every frame
+    """
+    pixels, events = [], []
+    for g, group in enumerate(groups):
+        offset, stops = 0, []
+        for segment in group:
+            stops.append(offset + plan_segment(segment))
+            offset += len(segment)
+        stops = np.concatenate(stops) if stops else np.zeros(0, np.int64)
+        pixels.append(
+            (
+                np.concatenate([segment.ys for segment in group]),
+                np.concatenate([segment.xs for segment in group]),
+                np.concatenate(
+                    [
+                        np.broadcast_to(segment.color, (len(segment), 3))
+                        for segment in group
+                    ]
+                ),
+            )
+        )
+        # frame t of the group is due at (t + 1) / frames of the phase
+        events.extend(
+            ((t + 1) / len(stops), g, stop)
+            for t, stop in enumerate(stops.tolist())
+        )
+    events.sort()
+    chunks, ends, done, count = [], [], [0] * len(pixels), 0
+    for _, g, stop in events:
+        chunks.append((g, done[g], stop))
+        count += stop - done[g]
+        ends.append(count)
+        done[g] = stop
+    # pixels after the last frame of a group
+    chunks.extend((g, done[g], len(ys)) for g, (ys, _, _) in enumerate(pixels))
+    ys, xs, colors = (
+        np.concatenate([pixels[g][i][start:stop] for g, start, stop in chunks])
+        for i in range(3)
+    )
+    return ys, xs, colors.astype(np.uint8), np.array(ends, np.int64)
+
+
+def share_array(array: np.ndarray) -> Tuple[SharedMemory, tuple]:
+    """Copies the array to shared memory, returns the memory + its spec"""
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec: tuple) -> Tuple[SharedMemory, np.ndarray]:
+    name, shape, dtype = spec
+    shm = SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype, buffer=shm.buf)
+
+
+def get_worker_canvas(
+    name: str, canvas: np.ndarray, painted: int
+) -> Tuple[np.ndarray, int]:
+    """
+    Canvas of the process to paint on from 'painted' pixels of the order,
+    the one of its previous range if it is not past it, a copy of the
+    shared canvas(at the start of the phase) otherwise
+    """
+    if name in WORKER_CANVASES and WORKER_CANVASES[name][1] <= painted:
+        return WORKER_CANVASES[name]
+    # canvases of the other phases are not needed anymore
+    WORKER_CANVASES.clear()
+    return canvas.copy(), 0
+
+
+def render_frame_range(
+    frame_range: Tuple[int, int],
+    specs: dict,
+    file_name: str,
+    target_dir: str,
+    image_format: str,
+    params: Iterator[int],
+):
+    """
+    Renders(saves) the frames [start, stop) of a phase, returns the errors
+    """
+    errors = []
+    start, stop = frame_range
+    shms, arrays = [], {}
+    try:
+        for name, spec in specs.items():
+            shm, arrays[name] = attach_array(spec)
+            shms.append(shm)
+        ys, xs, colors, ends = (
+            arrays[name] for name in ("ys", "xs", "colors", "ends")
+        )
+        canvas_name = specs["canvas"][0]
+        image, painted = get_worker_canvas(
+            canvas_name,
+            canvas=arrays["canvas"],
+            painted=int(ends[start - 1]) if start else 0,
+        )
+        for k in range(start, stop):
+            end = int(ends[k])
+            image[ys[painted:end], xs[painted:end]] = colors[painted:end]
+            painted = end
+            file_path = os.path.join(
+                target_dir, f"{file_name}_{k}{image_format}"
+            )
+            if os.path.exists(file_path):
+                continue
+            if not cv2.imwrite(file_path, image, params):
+                errors.append(f"{file_path}: not written")
+        WORKER_CANVASES[canvas_name] = (image, painted)
+    except Exception as e:
+        errors.append(str(e))
+    finally:
+        # the views have to be released before the memory is closed
+        arrays = ys = xs = colors = ends = None
+        for shm in shms:
+            shm.close()
+    return errors
+
+
+def render_tiled_frames(
+    canvas: np.ndarray,
+    order: Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray],
+    file_name: str,
+    target_dir: str,
+    workers: int,
+    image_format: str,
+    params: Iterator[int] = None,
+):
+    """
+    Renders the frames of a phase in a pool of 'workers' processes,
+    sharing the canvas(at the start of the phase) and the pixel order.
+    Frame k is saved as {file_name}_{k}{image_format}.
+    """
+    ys, xs, colors, ends = order
+    shms, specs = [], {}
+    try:
+        for name, array in (
+            ("canvas", canvas),
+            ("ys", ys),
+            ("xs", xs),
+            ("colors", colors),
+            ("ends", ends),
+        ):
+            shm, specs[name] = share_array(array)
+            shms.append(shm)
+        bounds = np.linspace(
+            0,
+            len(ends),
+            min(len(ends), workers * FRAME_RANGES_PER_WORKER) + 1,
+        ).astype(int)
+        for errors in parallel_map(
+            partial(
+                render_frame_range,
+                specs=specs,
+                file_name=file_name,
+                target_dir=target_dir,
+                image_format=image_format,
+                params=params or [],
+            ),
+            list(zip(bounds[:-1].tolist(), bounds[1:].tolist())),
+            workers=workers,
+        ):
+            for error in errors:
+                print(f"Failed to save snapshot {error}")
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
@@ -1,19 +1,28 @@
 import math
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Iterator, Tuple
+from typing import Callable, Iterator, Tuple
 
 import cv2
 import numpy as np
+from PIL import Image as PILImage
 
 from constants import (
+    ADAPTIVE_THRESHOLD_BLOCK_SIZE,
+    ADAPTIVE_THRESHOLD_C,
     BIN_FOLDER_NAME,
+    BINARY_THRESHOLD,
+    DEFAULT_CONNECTIVITY,
     MAX_IMAGE_SIZE,
+    PREVIEW_FOLDER_NAME,
     RES_FOLDER_NAME,
     TARGET_PATH,
+    Threshold,
 )
 from image import ImageSegment, Point
+from segment_stats import SegmentStats
 
 
 def create_empty_image(size: Iterator[int]) -> np.ndarray:
@@ -29,13 +38,29 @@ def get_image_size(image: np.ndarray):
     return image.shape[:2]
 
 
+def get_downscale_size(
+    height: int, width: int, max_size: int = MAX_IMAGE_SIZE
+) -> Tuple[int, int]:
+    """(width, height) with the longest side at most max_size"""
+    scale = min(1.0, max_size / max(height, width))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
 def get_image_resize(
-    image: np.ndarray, interpolation=cv2.INTER_AREA, resize: Tuple[int] = None
+    image: np.ndarray,
+    interpolation=cv2.INTER_AREA,
+    resize: Tuple[int] = None,
+    max_size: int = MAX_IMAGE_SIZE,
 ) -> np.ndarray:
+    """
+    Resizes the image to 'resize'(width, height), by default downscales
+    it to max_size preserving the aspect ratio
+    """
     if not resize:
         height, width = get_image_size(image=image)
-        size = min(MAX_IMAGE_SIZE, height, width)
-        resize = (size, size)
+        resize = get_downscale_size(height, width, max_size=max_size)
+        if resize == (width, height):
+            return image
     image = cv2.resize(image, resize, interpolation=interpolation)
     return image
 
@@ -44,8 +69,152 @@ def get_image_grayscale(image: np.ndarray) -> np.ndarray:
     return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
 
 
-def get_image_binary(image: np.ndarray) -> np.ndarray:
-    return cv2.threshold(image, 150, 255, cv2.THRESH_BINARY)[1]
+def get_image_binary(
+    image: np.ndarray,
+    threshold: int = BINARY_THRESHOLD,
+    method: str = Threshold.FIXED,
+) -> np.ndarray:
+    if method == Threshold.ADAPTIVE:
+        return cv2.adaptiveThreshold(
+            image,
+            255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY,
+            ADAPTIVE_THRESHOLD_BLOCK_SIZE,
+            ADAPTIVE_THRESHOLD_C,
+        )
+    threshold_type = cv2.THRESH_BINARY
+    if method == Threshold.OTSU:
+        threshold_type |= cv2.THRESH_OTSU
+    # in place, the grayscale image is not needed any more
+    return cv2.threshold(image, threshold, 255, threshold_type, dst=image)[1]
+
+
+def get_image_file_size(image_path: str) -> Tuple[int, int]:
+    """(height, width) of an image file, read from its header only"""
+    with PILImage.open(image_path) as image:
+        width, height = image.size
+    return height, width
+
+
+def read_image(image_path: str, max_size: int = MAX_IMAGE_SIZE) -> np.ndarray:
+    """
+    Decodes an image as grayscale. JPEGs are decoded at a reduced
+    resolution(1/2, 1/4 or 1/8) when that is still at least max_size.
+    """
+    flag = cv2.IMREAD_GRAYSCALE
+    if image_path.lower().endswith((".jpg", ".jpeg")):
+        longest_side = max(get_image_file_size(image_path))
+        for factor, reduced_flag in (
+            (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+            (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+            (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+        ):
+            if longest_side // factor >= max_size:
+                flag = reduced_flag
+                break
+    return cv2.imread(image_path, flag)
+
+
+def preprocess_image(
+    image: np.ndarray,
+    max_size: int = MAX_IMAGE_SIZE,
+    threshold: int = BINARY_THRESHOLD,
+    threshold_method: str = Threshold.FIXED,
+) -> np.ndarray:
+    """
+    Fused preprocessing: grayscale -> downscale -> threshold.
+    The image is converted to grayscale first, so that the resize works
+    on a single channel, and thresholded in place.
+    """
+    source = image
+    if image.ndim == 3:
+        image = get_image_grayscale(image=image)
+    resized = get_image_resize(image=image, max_size=max_size)
+    if resized is source:
+        # do not threshold the caller's image in place
+        resized = source.copy()
+    return get_image_binary(
+        image=resized, threshold=threshold, method=threshold_method
+    )
+
+
+def get_label_map(
+    image: np.ndarray, connectivity: int = DEFAULT_CONNECTIVITY
+) -> Tuple[np.ndarray, int]:
+    """
+    Labels contiguously connected pixels with the same color.
+    * Labels are numbered in the order the flood fill would discover
+      them, i.e. by their first pixel in a column(x) major scan
+    * Returns the label map and the total count of labels
+    """
+    if image.ndim == 3:
+        # pack the channels so that every color is a single value
+        image = image.astype(np.int64)
+        image = (image[..., 0] << 16) | (image[..., 1] << 8) | image[..., 2]
+    label_map = np.zeros(image.shape[:2], np.int32)
+    count = 0
+    for value in np.unique(image):
+        mask = (image == value).astype(np.uint8)
+        total, labels = cv2.connectedComponents(
+            mask, connectivity=connectivity, ltype=cv2.CV_32S
+        )
+        component = labels > 0
+        label_map[component] = labels[component] + (count - 1)
+        count += total - 1
+    # renumber the labels by their first occurrence in the x major scan
+    _, first_index = np.unique(label_map.T.ravel(), return_index=True)
+    remap = np.empty(count, np.int32)
+    remap[np.argsort(first_index)] = np.arange(count, dtype=np.int32)
+    return remap[label_map], count
+
+
+def get_flood_order(
+    label_map: np.ndarray,
+    count: int,
+    connectivity: int = DEFAULT_CONNECTIVITY,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (row major)flat indices of the pixels grouped by label, in the order
+    the flood fill visits them + the offsets of the labels in it.
+    * the fill starts at the first pixel of a label in the x major scan
+      and visits the neighbors depth first(last pushed, first visited)
+    * labels of up to 2 pixels are in the x major order already, only
+      the larger ones are filled(per pixel)
+    """
+    height, width = label_map.shape
+    flat_label_map = label_map.T.ravel()
+    offsets = np.zeros(count + 1, np.int64)
+    np.cumsum(np.bincount(flat_label_map, minlength=count), out=offsets[1:])
+    # x major order of the pixels grouped by label, as row major indices
+    # of the label map padded by a border(no label), so that the
+    # neighbors need no bounds checks
+    stride = width + 2
+    xs, ys = np.divmod(np.argsort(flat_label_map, kind="stable"), height)
+    order = (ys + 1) * stride + xs + 1
+    labels = np.pad(label_map, 1, constant_values=-1).ravel().tolist()
+    # the neighbors in the order the flood fill pushes them
+    steps = [1, -1, stride, -stride]
+    if connectivity == 8:
+        steps += [-stride - 1, -stride + 1, stride + 1, stride - 1]
+    seen = bytearray(len(labels))
+    for label in np.flatnonzero(np.diff(offsets) > 2).tolist():
+        start, stop = int(offsets[label]), int(offsets[label + 1])
+        stack, visited = [int(order[start])], []
+        while stack:
+            pixel = stack.pop()
+            if seen[pixel]:
+                continue
+            seen[pixel] = 1
+            visited.append(pixel)
+            for step in steps:
+                neighbor = pixel + step
+                # visited neighbors would be skipped when popped
+                if labels[neighbor] == label and not seen[neighbor]:
+                    stack.append(neighbor)
+        order[start:stop] = visited
+    ys, xs = np.divmod(order, stride)
+    return (ys - 1) * width + xs - 1, offsets
 
 
 def sanitize_file_name(file_name):
@@ -59,25 +228,31 @@ def get_filename_from_path(file_path: str, include_ext: bool = True):
     return filename
 
 
-def get_target_dir_binary(image_path):
+def get_target_dir(image_path, preview: bool = False):
+    """
+    Directory of the files of an image, the preview renders are kept
+    apart from the final ones
+    """
     target_dir = os.path.join(
         TARGET_PATH,
         sanitize_file_name(
             get_filename_from_path(image_path, include_ext=False)
         ),
     )
+    if preview:
+        target_dir = os.path.join(target_dir, PREVIEW_FOLDER_NAME)
+    return target_dir
+
+
+def get_target_dir_binary(image_path, preview: bool = False):
+    target_dir = get_target_dir(image_path, preview=preview)
     target_dir_binary = os.path.join(target_dir, BIN_FOLDER_NAME)
     mkdir(target_dir_binary)
     return target_dir_binary
 
 
-def get_target_dir_result(image_path):
-    target_dir = os.path.join(
-        TARGET_PATH,
-        sanitize_file_name(
-            get_filename_from_path(image_path, include_ext=False)
-        ),
-    )
+def get_target_dir_result(image_path, preview: bool = False):
+    target_dir = get_target_dir(image_path, preview=preview)
     target_dir_result = os.path.join(target_dir, RES_FOLDER_NAME)
     mkdir(target_dir_result)
     return target_dir_result
@@ -88,24 +263,198 @@ def get_distance(p1: Point, p2: Point) -> float:
 
 
 def comparator_img_seg_size(segment: ImageSegment):
-    return len(segment.points)
+    return len(segment)
 
 
-def comparator_x_y(segment: ImageSegment, ref_point: Point):
-    segment.sort_x()
-    point = segment.points[0]
-    return point.y, point.x
-    return get_distance(ref_point, point)
+def comparator_x_y(
+    segment: ImageSegment, ref_point: Point, stats: SegmentStats = None
+):
+    """
+    (y, x) of the segment's first point in x major order, read from the
+    statistics when given
+    """
+    if stats is not None and segment.index is not None:
+        x, y = stats.anchor[segment.index].tolist()
+        return y, x
+    x = segment.xs.min()
+    return int(segment.ys[segment.xs == x].min()), int(x)
 
 
 def comparator_closest_segment(
     segment: ImageSegment, ref_segment: ImageSegment
 ):
-    point = segment.points[0]
-    ref_point = ref_segment.points[0]
+    point = segment.anchor
+    ref_point = ref_segment.anchor
     return get_distance(point, ref_point)
 
 
+def parallel_map(
+    function: Callable,
+    items: Iterator,
+    workers: int = 1,
+) -> Iterator:
+    """
+    Maps the items in a pool of 'workers' processes(in process for 1),
+    the results are yielded in the order of the items
+    """
+    if workers <= 1:
+        yield from map(function, items)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(function, items)
+
+
+def get_ring_cells(cx: int, cy: int, ring: int) -> Iterator[Tuple[int, int]]:
+    """Grid cells at a chebyshev distance of 'ring' from (cx, cy)"""
+    if ring == 0:
+        return [(cx, cy)]
+    cells = []
+    for d in range(-ring, ring + 1):
+        cells.extend(((cx + d, cy - ring), (cx + d, cy + ring)))
+    for d in range(-ring + 1, ring):
+        cells.extend(((cx - ring, cy + d), (cx + ring, cy + d)))
+    return cells
+
+
+# points of the chain compared at most at once, to break a tie
+TIE_BLOCK_SIZE = 64
+
+
+def break_tie(
+    points: np.ndarray, tied: np.ndarray, chain: Iterator[int]
+) -> int:
+    """
+    The tied point closest to the points of the chain before its last,
+    latest first, then the lowest index
+    """
+    stop, size = len(chain) - 1, 1
+    while len(tied) > 1 and stop > 0:
+        if size == 2:
+            # the same points stay tied, the lowest index goes first
+            firsts = {}
+            for i in sorted(tied.tolist()):
+                firsts.setdefault(tuple(points[i].tolist()), i)
+            tied = np.array(list(firsts.values()))
+        # (tied, refs) distances to a block of the chain, latest first,
+        # most ties are broken by the first points
+        refs = chain[max(stop - size, 0) : stop][::-1]
+        stop, size = stop - len(refs), min(size * 2, TIE_BLOCK_SIZE)
+        distances = (
+            (points[tied][:, None, :] - points[refs][None, :, :]) ** 2
+        ).sum(axis=2)
+        first = np.lexsort(distances.T[::-1])[0]
+        tied = tied[(distances == distances[first]).all(axis=1)]
+    return int(tied.min())
+
+
+def get_nearest_chain(points: np.ndarray) -> Iterator[int]:
+    """
+    Greedy nearest neighbor chain over (n, 2) x/y points, starting at
+    the first point: every next point is the closest remaining point to
+    the previous one. Ties go to the point closest to the point before
+    it, and so on back the chain, then to the lower index. The same
+    order as re-sorting the remaining points(stable) after every pick.
+    * the points are bucketed in a grid of ~1-2 points per cell, so every
+      step only searches the rings of cells around the previous point
+    * when the rings get large compared to the remaining points, the
+      remaining points are searched directly(vectorized)
+    """
+    total = len(points)
+    if total == 0:
+        return []
+    points = np.asarray(points, np.float64)
+    origin = points.min(axis=0)
+    extent = np.maximum(points.max(axis=0) - origin, 1)
+    cell_size = max(float(np.sqrt(extent[0] * extent[1] / total)), 1.0)
+    while True:
+        cells = np.floor((points - origin) / cell_size).astype(np.int64)
+        # clustered points, refine the grid to ~2 points per occupied cell
+        occupied = len(np.unique(cells, axis=0))
+        if occupied * 2 >= total or cell_size <= 1:
+            break
+        cell_size = max(cell_size / 2, 1.0)
+    buckets = {}
+    for i, cell in enumerate(map(tuple, cells.tolist())):
+        buckets.setdefault(cell, []).append(i)
+    remaining = np.ones(total, bool)
+
+    def remove(i):
+        remaining[i] = False
+        cell = tuple(cells[i].tolist())
+        buckets[cell].remove(i)
+        if not buckets[cell]:
+            del buckets[cell]
+
+    chain = [0]
+    remove(0)
+    for count in range(total - 1, 0, -1):
+        ref = chain[-1]
+        ref_x, ref_y = points[ref]
+        cx, cy = cells[ref].tolist()
+        best, best_distance = None, None
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > count // 32 + 1 and ring > 0:
+                # a vectorized scan is cheaper than visiting the cells
+                candidates = np.flatnonzero(remaining)
+                distances = (points[candidates, 0] - ref_x) ** 2 + (
+                    points[candidates, 1] - ref_y
+                ) ** 2
+                best = candidates[distances == distances.min()]
+                break
+            bucket_items = [
+                buckets[cell]
+                for cell in get_ring_cells(cx, cy, ring)
+                if cell in buckets
+            ]
+            if bucket_items:
+                candidates = np.concatenate(bucket_items)
+                distances = (points[candidates, 0] - ref_x) ** 2 + (
+                    points[candidates, 1] - ref_y
+                ) ** 2
+                distance = distances.min()
+                tied = candidates[distances == distance]
+                if best is None or distance < best_distance:
+                    best, best_distance = tied, distance
+                elif distance == best_distance:
+                    best = np.concatenate((best, tied))
+            # points beyond this ring are at least ring * cell_size away
+            if best is not None and best_distance < (ring * cell_size) ** 2:
+                break
+            ring += 1
+        best = (
+            break_tie(points, best, chain) if len(best) > 1 else int(best[0])
+        )
+        chain.append(best)
+        remove(best)
+    return chain
+
+
+def get_frame_budget(sizes: Iterator[int], frame_count: int) -> np.ndarray:
+    """
+    Splits frame_count frames across segments proportional to their
+    sizes(largest remainder), so that the frames add up exactly. A segment
+    gets at most one frame per pixel.
+    """
+    sizes = np.asarray(sizes, np.int64)
+    total = int(sizes.sum())
+    frame_count = min(max(frame_count, 0), total)
+    if frame_count == 0:
+        return np.zeros(len(sizes), np.int64)
+    frames, remainders = np.divmod(sizes * frame_count, total)
+    left = frame_count - int(frames.sum())
+    frames[np.argsort(-remainders, kind="stable")[:left]] += 1
+    return frames
+
+
+def get_frame_stops(pixel_count: int, frame_count: int) -> np.ndarray:
+    """
+    (exclusive)pixel index after which each of frame_count evenly spread
+    frames is taken, the last frame shows the complete segment
+    """
+    return -(-np.arange(1, frame_count + 1) * pixel_count // frame_count)
+
+
 def comparator_alphanum(item: str):
     def tryint(item):
         try:
@@ -0,0 +1,93 @@
+"""
+Encoding of videos with an encoder profile(see ENCODER_PROFILES).
+
+* the profiles trade speed for quality(x264 preset, crf), the encoder
+  threads default to the cores of the machine, shared by the workers
+* the frames of a clip can be encoded in time chunks, each by its own
+  process, the chunks are joined without re-encoding(see concat_clips)
+"""
+import os
+from typing import Iterator, Tuple
+
+import numpy as np
+from imageio_ffmpeg import write_frames
+from moviepy.config import change_settings
+from moviepy.editor import VideoClip
+
+from constants import ENCODER_PROFILES, VIDEO_CODEC, Encoder
+
+
+def set_ffmpeg_binary(file_path: str):
+    """
+    Uses the ffmpeg at file_path for moviepy and imageio, in this process
+    and the ones it starts
+    """
+    os.environ["FFMPEG_BINARY"] = file_path
+    os.environ["IMAGEIO_FFMPEG_EXE"] = file_path
+    change_settings({"FFMPEG_BINARY": file_path})
+
+
+def get_threads(workers: int = 1, threads: int = 0) -> int:
+    """Encoder threads per worker, the cores are shared by the workers"""
+    return threads or max((os.cpu_count() or 1) // max(workers, 1), 1)
+
+
+def get_output_params(
+    profile: str = Encoder.FINAL, threads: int = 0, preset: bool = True
+) -> Iterator[str]:
+    """
+    ffmpeg(output) parameters of an encoder profile, without the preset
+    for writers that set it themselves(moviepy's write_videofile)
+    """
+    settings = ENCODER_PROFILES[profile]
+    params = ["-preset", settings["preset"]] if preset else []
+    return params + [
+        "-crf",
+        str(settings["crf"]),
+        "-threads",
+        str(get_threads(threads=threads)),
+    ]
+
+
+def get_frame_count(duration: float, frame_rate: int) -> int:
+    """Frames of a clip, as moviepy writes them"""
+    return len(np.arange(0, duration, 1.0 / frame_rate))
+
+
+def get_frame_ranges(
+    frame_count: int, chunks: int
+) -> Iterator[Tuple[int, int]]:
+    bounds = np.linspace(0, frame_count, min(chunks, frame_count) + 1)
+    bounds = bounds.astype(int).tolist()
+    return list(zip(bounds[:-1], bounds[1:])) or [(0, 0)]
+
+
+def encode_frames(
+    video_clip: VideoClip,
+    frame_range: Tuple[int, int],
+    file_path: str,
+    frame_rate: int,
+    profile: str = Encoder.FINAL,
+    threads: int = 0,
+) -> str:
+    """
+    Encodes the frames [start, stop) of a clip(no audio), frame k is
+    the clip at k / frame_rate
+    """
+    start, stop = frame_range
+    writer = write_frames(
+        file_path,
+        tuple(video_clip.size),
+        fps=frame_rate,
+        codec=VIDEO_CODEC,
+        pix_fmt_out=ENCODER_PROFILES[profile]["pix_fmt"],
+        quality=None,
+        macro_block_size=2,
+        output_params=get_output_params(profile=profile, threads=threads),
+    )
+    writer.send(None)
+    for k in range(start, stop):
+        frame = video_clip.get_frame(k / frame_rate)
+        writer.send(np.ascontiguousarray(frame, np.uint8))
+    writer.close()
+    return file_path